@@ -1,13 +1,23 @@
 """
 Script to adjudicate definitions from multiple models.
 - If all three models return Low or Medium confidence, Claude Sonnet 4 regenerates the definition
-- If two or all three models provide High confidence, Claude Sonnet 4 selects the most accurate definition
+- If two or all three models provide High confidence, Claude Sonnet 4 selects the most accurate definition,
+  unless those High confidence definitions are near-identical, in which case the first one is kept without calling Claude
 """
 
+import re
 import os
-import json
+import sys
+import difflib
+import asyncio
+from collections import Counter
+import orjson
 from dotenv import load_dotenv
 from anthropic import Anthropic
+import llm_cache
+from json_stream import load_json_list, atomic_write_json
+from definition_prompt import PROMPT_TEMPLATE, get_act_url, item_prompt, paragraphs_urls
+from definition_schema import DEFINITION_SCHEMA, SELECTION_SCHEMA
 
 # Load environment variables
 load_dotenv()
@@ -19,14 +29,17 @@ if not api_key:
 
 client = Anthropic(api_key=api_key)
 
-def load_prompt_template():
-    """Load the original prompt template from prompt.txt"""
-    try:
-        with open('prompt.txt', 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        raise FileNotFoundError("prompt.txt file not found!")
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
+
+# Number of adjudicated items between two checkpoint writes of the output file
+CHECKPOINT_EVERY = 10
 
+# Minimum pairwise similarity (difflib ratio) for High confidence definitions to count as agreeing
+AGREEMENT_THRESHOLD = 0.9
+
+# adjudication_method of the first model's definition, kept when adjudication fails.
+# Such items are not counted as adjudicated, so the next run adjudicates them again
+FALLBACK_METHOD = "fallback"
 
 def load_adjudication_prompt_template():
     """Load the adjudication prompt template from prompt_for_ajudication.txt"""
@@ -37,41 +50,75 @@ def load_adjudication_prompt_template():
         raise FileNotFoundError("prompt_for_ajudication.txt file not found!")
 
 
-def call_claude_sonnet(prompt_text):
+# Read once at import, as PROMPT_TEMPLATE
+ADJUDICATION_TEMPLATE = load_adjudication_prompt_template()
+
+_WS_RE = re.compile(r'\s+')
+
+
+def call_claude_sonnet(template, prompt_tail, schema=DEFINITION_SCHEMA, tool_name="emit_definition"):
     """
-    Call Claude Sonnet 4 API with the prompt and return the response.
+    Call Claude Sonnet 4 API with the prompt and return the response as a dictionary.
+    Claude is forced to answer through a tool whose input schema is the expected JSON object,
+    so the response never needs to be parsed from free text.
+    The prompt is the template followed by the per-item tail. The template block is marked for
+    Anthropic prompt caching, so its tokens are reused across calls instead of being reprocessed.
+    Responses are served from the on-disk cache when the same prompt was already sent.
     """
+    template_block = template + "\n\n"
+    prompt_text = template_block + prompt_tail
+    cached = llm_cache.get(CLAUDE_MODEL, prompt_text)
+    if cached is not None:
+        return orjson.loads(cached)
+    
     try:
         message = client.messages.create(
-            model="claude-sonnet-4-20250514",
+            model=CLAUDE_MODEL,
             max_tokens=4096,
+            tools=[{
+                "name": tool_name,
+                "description": "Return the JSON object requested in the prompt.",
+                "input_schema": schema
+            }],
+            tool_choice={"type": "tool", "name": tool_name},
             messages=[
-                {"role": "user", "content": prompt_text}
+                {"role": "user", "content": [
+                    {"type": "text", "text": template_block, "cache_control": {"type": "ephemeral"}},
+                    {"type": "text", "text": prompt_tail}
+                ]}
             ]
         )
         
-        # Extract text from response
-        response_text = ""
-        for content_block in message.content:
-            if content_block.type == "text":
-                response_text += content_block.text
-        
-        return response_text.strip()
+        response_json = message.content[0].input
     
     except Exception as e:
         print(f"Error calling Claude API: {str(e)}")
         raise
+    
+    llm_cache.put(CLAUDE_MODEL, prompt_text, orjson.dumps(response_json).decode('utf-8'))
+    return response_json
+
+
+# Numeric confidence levels for comparison (anything unrecognised counts as Low)
+_CONFIDENCE_LEVELS = {"high": 3, "medium": 2, "low": 1}
 
 
 def get_confidence_level(confidence_str):
     """Convert confidence string to numeric level for comparison"""
-    confidence_lower = confidence_str.lower() if confidence_str else "low"
-    if confidence_lower == "high":
-        return 3
-    elif confidence_lower == "medium":
-        return 2
-    else:
-        return 1
+    return _CONFIDENCE_LEVELS.get((confidence_str or "low").lower(), 1)
+
+
+def definitions_agree(definitions, threshold=AGREEMENT_THRESHOLD):
+    """
+    Check whether all definitions are textually near-identical
+    (pairwise difflib similarity of the normalised texts at least threshold).
+    """
+    texts = [_WS_RE.sub(' ', d.get("definition", "")).strip().lower() for d in definitions]
+    for i in range(len(texts)):
+        for j in range(i + 1, len(texts)):
+            if difflib.SequenceMatcher(None, texts[i], texts[j]).ratio() < threshold:
+                return False
+    return True
 
 
 def adjudicate_definitions(item_data, definitions):
@@ -85,166 +132,105 @@ def adjudicate_definitions(item_data, definitions):
     Returns:
         Final adjudicated definition dictionary
     """
-    # Count confidence levels
-    confidence_levels = [get_confidence_level(d.get("confidence", "Low")) for d in definitions]
-    high_count = sum(1 for c in confidence_levels if c == 3)
+    # Score each definition once and keep those with High confidence
+    scored = [(d, get_confidence_level(d.get("confidence"))) for d in definitions]
+    high_definitions = [d for d, level in scored if level == 3]
+    high_count = len(high_definitions)
     
     # Get original item data for regeneration
     key_phrase = item_data.get("key_phrase", "")
-    legislation_urls = item_data.get("legislation_urls", [])
-    paragraphs = item_data.get("paragraphs", [])
+    act_url = get_act_url(item_data)
     
-    act_url = ""
-    if legislation_urls:
-        act_url = legislation_urls[0].split("/section")[0]
+    if high_count >= 2 and definitions_agree(high_definitions):
+        # The High confidence models agree - no need to ask Claude to choose between them
+        print(f"  → {high_count} models have High confidence and agree. Keeping the first definition...")
+        
+        agreed = high_definitions[0]
+        final_definition = {
+            "key_phrase": key_phrase,
+            "definition": agreed.get("definition", ""),
+            "reasoning": agreed.get("reasoning", ""),
+            "confidence": "High (Agreed)",
+            "adjudication_method": "trivial_agreement",
+            "models_used": [d.get("model") for d in high_definitions],
+            "act_url": act_url,
+            "paragraphs_urls": paragraphs_urls(item_data),
+        }
+        
+        return final_definition
     
-    if high_count >= 2:
+    elif high_count >= 2:
         # Two or more models have High confidence - select best definition
         print(f"  → {high_count} models have High confidence. Selecting best definition...")
         
-        adjudication_prompt = load_adjudication_prompt_template()
-        adjudication_prompt += "\n\n"
-        adjudication_prompt += f"Key legal term: {key_phrase}\n\n"
-        adjudication_prompt += f"URL of the UK act from which the term is taken: {act_url}\n\n"
-        
-        # Add paragraphs
-        for i, paragraph in enumerate(paragraphs, start=1):
-            text = paragraph.get("paragraph_text", "")
-            import re
-            cleaned_text = re.sub(r'\s+', ' ', text).strip()
-            adjudication_prompt += f"Paragraph #{i}: {cleaned_text}\n\n"
+        parts = [item_prompt(item_data)]
         
         # Add definitions from models with High confidence
-        high_definitions = [d for d in definitions if get_confidence_level(d.get("confidence", "Low")) == 3]
-        adjudication_prompt += "\nDefinitions to select from:\n\n"
+        parts.append("\nDefinitions to select from:\n\n")
         for idx, defn in enumerate(high_definitions, 1):
-            adjudication_prompt += f"Definition {idx} (from {defn.get('model', 'unknown')}):\n"
-            adjudication_prompt += f"{defn.get('definition', '')}\n\n"
+            parts.append(f"Definition {idx} (from {defn.get('model', 'unknown')}):\n")
+            parts.append(f"{defn.get('definition', '')}\n\n")
+        adjudication_tail = "".join(parts)
         
         # Call Claude to select best definition
-        response_str = call_claude_sonnet(adjudication_prompt)
+        response_json = call_claude_sonnet(ADJUDICATION_TEMPLATE, adjudication_tail,
+                                           schema=SELECTION_SCHEMA, tool_name="emit_selection")
         
-        try:
-            response_json = json.loads(response_str)
-            final_definition = {
-                "key_phrase": response_json.get("key legal term", key_phrase),
-                "definition": response_json.get("definition", ""),
-                "reasoning": response_json.get("reasoning", ""),
-                "confidence": "High (Selected)",
-                "adjudication_method": "selection",
-                "models_used": [d.get("model") for d in high_definitions],
-                "act_url": act_url,
-                "paragraphs_urls": [p.get("case_law_url", "") for p in paragraphs],
-            }
-            
-            # Add paragraphs texts
-            for idx, para in enumerate(paragraphs, start=1):
-                final_definition[f"paragraphs_texts_{idx}"] = para.get("paragraph_text", "")
-            
-            return final_definition
-            
-        except json.JSONDecodeError as e:
-            print(f"  ✗ JSON parsing error in selection: {str(e)}")
-            # Fall back to first high confidence definition
-            return high_definitions[0]
+        final_definition = {
+            "key_phrase": key_phrase,
+            "definition": response_json.get("definition", ""),
+            "reasoning": response_json.get("reasoning", ""),
+            "confidence": "High (Selected)",
+            "adjudication_method": "selection",
+            "models_used": [d.get("model") for d in high_definitions],
+            "act_url": act_url,
+            "paragraphs_urls": paragraphs_urls(item_data),
+        }
+        
+        return final_definition
     
     else:
         # All models have Low or Medium confidence - regenerate
         print(f"  → All models have Low/Medium confidence. Regenerating with Claude Sonnet 4...")
         
-        original_prompt = load_prompt_template()
-        original_prompt += "\n\n"
-        original_prompt += f"Key legal term: {key_phrase}\n\n"
-        original_prompt += f"URL of the UK act from which the term is taken: {act_url}\n\n"
-        
-        # Add paragraphs
-        for i, paragraph in enumerate(paragraphs, start=1):
-            text = paragraph.get("paragraph_text", "")
-            import re
-            cleaned_text = re.sub(r'\s+', ' ', text).strip()
-            original_prompt += f"Paragraph #{i}: {cleaned_text}\n\n"
+        original_tail = item_prompt(item_data)
         
         # Call Claude to regenerate
-        response_str = call_claude_sonnet(original_prompt)
+        response_json = call_claude_sonnet(PROMPT_TEMPLATE, original_tail)
         
-        try:
-            response_json = json.loads(response_str)
-            final_definition = {
-                "key_phrase": response_json.get("key legal term", key_phrase),
-                "definition": response_json.get("definition", ""),
-                "reasoning": response_json.get("reasoning", ""),
-                "confidence": response_json.get("confidence", "Low"),
-                "adjudication_method": "regeneration",
-                "models_used": [d.get("model") for d in definitions],
-                "act_url": act_url,
-                "paragraphs_urls": [p.get("case_law_url", "") for p in paragraphs],
-            }
-            
-            # Add paragraphs texts
-            for idx, para in enumerate(paragraphs, start=1):
-                final_definition[f"paragraphs_texts_{idx}"] = para.get("paragraph_text", "")
-            
-            return final_definition
-            
-        except json.JSONDecodeError as e:
-            print(f"  ✗ JSON parsing error in regeneration: {str(e)}")
-            # Fall back to first definition
-            return definitions[0]
+        final_definition = {
+            "key_phrase": key_phrase,
+            "definition": response_json.get("definition", ""),
+            "reasoning": response_json.get("reasoning", ""),
+            "confidence": response_json.get("confidence", "Low"),
+            "adjudication_method": "regeneration",
+            "models_used": [d.get("model") for d in definitions],
+            "act_url": act_url,
+            "paragraphs_urls": paragraphs_urls(item_data),
+        }
+        
+        return final_definition
 
 
-def main(claude_definitions_file=None,
-         gpt4o_definitions_file='definitions_gpt4o_mini.json',
-         llama_definitions_file='definitions_llama.json',
-         deepseek_definitions_file='definitions_deepseek.json',
-         original_data_file='selected.json',
-         output_file='definitions_adjudicated.json',
-         limit=None):
-    """
-    Main function to adjudicate definitions from multiple models.
-    Claude Sonnet 4 is used for adjudication/regeneration, not in the first step.
-    
-    Args:
-        claude_definitions_file: Not used (Claude only for adjudication)
-        gpt4o_definitions_file: File with GPT-4o-mini definitions
-        llama_definitions_file: File with Llama definitions
-        deepseek_definitions_file: File with Deepseek definitions
-        original_data_file: Original selected.json file
-        output_file: Output file for adjudicated definitions
-        limit: Number of items to process (None for all)
-    """
-    print("Loading definitions from all models...")
-    
-    # Load all definition files
-    with open(gpt4o_definitions_file, 'r', encoding='utf-8') as f:
-        gpt4o_defs = json.load(f)
-    
-    with open(llama_definitions_file, 'r', encoding='utf-8') as f:
-        llama_defs = json.load(f)
-    
-    with open(deepseek_definitions_file, 'r', encoding='utf-8') as f:
-        deepseek_defs = json.load(f)
-    
-    # Load original data
-    with open(original_data_file, 'r', encoding='utf-8') as f:
-        original_data = json.load(f)
-    
-    # Limit if specified
-    if limit:
-        gpt4o_defs = gpt4o_defs[:limit]
-        llama_defs = llama_defs[:limit]
-        deepseek_defs = deepseek_defs[:limit]
-        original_data = original_data[:limit]
-    
+def fallback_definition(definition):
+    """The definition kept when adjudication fails, tagged so that it is redone on the next run"""
+    return dict(definition, adjudication_method=FALLBACK_METHOD)
+
+
+def _adjudicate_from_files(original_data, done, gpt4o_defs, llama_defs, deepseek_defs, record):
+    """Adjudicate the items not in done from the definitions already generated by the three models"""
     # Create dictionaries keyed by key_phrase for easier lookup
     gpt4o_dict = {d.get("key_phrase"): d for d in gpt4o_defs}
     llama_dict = {d.get("key_phrase"): d for d in llama_defs}
     deepseek_dict = {d.get("key_phrase"): d for d in deepseek_defs}
     
-    results = []
     total = len(original_data)
     
     for idx, item in enumerate(original_data, 1):
         key_phrase = item.get("key_phrase", "")
+        if key_phrase in done:
+            continue
+        
         print(f"\n[{idx}/{total}] Adjudicating: {key_phrase}")
         
         # Get definitions from all three models
@@ -266,27 +252,145 @@ def main(claude_definitions_file=None,
         try:
             # Adjudicate
             final_definition = adjudicate_definitions(item, definitions)
-            results.append(final_definition)
+            record(final_definition)
             print(f"  ✓ Adjudicated using method: {final_definition.get('adjudication_method', 'unknown')}")
             
         except Exception as e:
             print(f"  ✗ Error adjudicating {key_phrase}: {str(e)}")
             # Use first available definition as fallback
             if definitions:
-                results.append(definitions[0])
+                record(fallback_definition(definitions[0]))
             continue
+
+
+def _adjudicate_with_cascade(original_data, done, record):
+    """Adjudicate the items not in done with the provider cascade (see cascade.py)"""
+    # When this script is run directly, cascade gets this module instead of importing it a second time
+    # (which would create another Anthropic client and read the templates again)
+    if __name__ == "__main__":
+        sys.modules.setdefault("adjudicate_definitions", sys.modules[__name__])
+    # Imported here so the file-based adjudication does not need the OpenAI and Groq API keys
+    from cascade import adjudicate_all
+    
+    pending = [item for item in original_data if item.get("key_phrase", "") not in done]
+    print(f"Adjudicating {len(pending)} items with the provider cascade...")
+    
+    def on_result(final_definition):
+        record(final_definition)
+        print(f"  ✓ Adjudicated {final_definition.get('key_phrase', '')} "
+              f"using method: {final_definition.get('adjudication_method', 'unknown')}")
+    
+    outcomes = asyncio.run(adjudicate_all(pending, on_result=on_result))
+    for item, outcome in zip(pending, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"  ✗ Error adjudicating {item.get('key_phrase', '')}: {str(outcome)}")
+
+
+def main(claude_definitions_file=None,
+         gpt4o_definitions_file='definitions_gpt4o_mini.json',
+         llama_definitions_file='definitions_llama.json',
+         deepseek_definitions_file='definitions_deepseek.json',
+         original_data_file='selected.json',
+         output_file='definitions_adjudicated.json',
+         limit=None,
+         gpt4o_defs=None,
+         llama_defs=None,
+         deepseek_defs=None,
+         original_data=None,
+         cascade=False):
+    """
+    Main function to adjudicate definitions from multiple models.
+    Claude Sonnet 4 is used for adjudication/regeneration, not in the first step.
+    Items whose key phrase is already in output_file are skipped, so an interrupted run can be resumed.
+    Fallback definitions (adjudication failed) are not skipped: they are replaced by the new adjudication.
+    
+    Args:
+        claude_definitions_file: Not used (Claude only for adjudication)
+        gpt4o_definitions_file: File with GPT-4o-mini definitions
+        llama_definitions_file: File with Llama definitions
+        deepseek_definitions_file: File with Deepseek definitions
+        original_data_file: Original selected.json file
+        output_file: Output file for adjudicated definitions
+        limit: Number of items to process (None for all)
+        gpt4o_defs: In-memory GPT-4o-mini definitions (read from gpt4o_definitions_file if None)
+        llama_defs: In-memory Llama definitions (read from llama_definitions_file if None)
+        deepseek_defs: In-memory Deepseek definitions (read from deepseek_definitions_file if None)
+        original_data: In-memory selected.json items (read from original_data_file if None)
+        cascade: If True, ignore the definition files and generate definitions on the fly with the
+                 provider cascade: GPT-4o-mini first, Llama, Deepseek and Claude only when it is not
+                 confident (see cascade.py)
+    """
+    if not cascade:
+        print("Loading definitions from all models...")
+        
+        # Load definition files not already provided in memory
+        if gpt4o_defs is None:
+            with open(gpt4o_definitions_file, 'rb') as f:
+                gpt4o_defs = orjson.loads(f.read())
+        
+        if llama_defs is None:
+            with open(llama_definitions_file, 'rb') as f:
+                llama_defs = orjson.loads(f.read())
+        
+        if deepseek_defs is None:
+            with open(deepseek_definitions_file, 'rb') as f:
+                deepseek_defs = orjson.loads(f.read())
+    
+    # Load original data
+    if original_data is None:
+        with open(original_data_file, 'rb') as f:
+            original_data = orjson.loads(f.read())
+    
+    # Limit if specified (definitions are looked up by key phrase, so only the items are truncated)
+    if limit:
+        original_data = original_data[:limit]
+    
+    # Resume: keep adjudications from a previous run and skip their key phrases (not those of fallbacks)
+    results = load_json_list(output_file)
+    done = {d.get("key_phrase") for d in results if d.get("adjudication_method") != FALLBACK_METHOD}
+    fallbacks = {d.get("key_phrase") for d in results} - done
+    if results:
+        print(f"Resuming: {len(results)} definitions already in {output_file} ({len(fallbacks)} fallbacks to redo)")
+    
+    method_counts = Counter()
+    
+    def record(final_definition):
+        key_phrase = final_definition.get("key_phrase")
+        if key_phrase in fallbacks:
+            # Replace the fallback written by a previous run
+            fallbacks.discard(key_phrase)
+            results[:] = [d for d in results if d.get("key_phrase") != key_phrase]
+        results.append(final_definition)
+        method_counts[final_definition.get('adjudication_method', 'unknown')] += 1
+        
+        # Checkpoint periodically to bound the work lost if the process dies
+        if sum(method_counts.values()) % CHECKPOINT_EVERY == 0:
+            atomic_write_json(output_file, results)
+    
+    if cascade:
+        _adjudicate_with_cascade(original_data, done, record)
+    else:
+        _adjudicate_from_files(original_data, done, gpt4o_defs, llama_defs, deepseek_defs, record)
     
     # Save results
     print(f"\nSaving adjudicated results to {output_file}...")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    atomic_write_json(output_file, results)
     
     print(f"✓ Adjudicated {len(results)} definitions")
+    processed = sum(method_counts.values())
+    if processed:
+        # Share of items settled without a Claude call because the High confidence models agreed
+        agreed = method_counts["trivial_agreement"]
+        print(f"  - Methods this run: {dict(method_counts)}")
+        print(f"  - Trivial agreement: {agreed}/{processed} ({agreed / processed:.0%}) Claude calls skipped")
+        if cascade:
+            # Share of items that needed the other providers, to tune the thresholds in cascade.py
+            escalated = processed - method_counts["single_model_high"]
+            print(f"  - Cascade escalations: {escalated}/{processed} ({escalated / processed:.0%})")
     return results
 
 
 if __name__ == "__main__":
-    import sys
-    limit = int(sys.argv[1]) if len(sys.argv) > 1 else None
-    main(limit=limit)
-
+    args = [arg for arg in sys.argv[1:] if arg != "--cascade"]
+    limit = int(args[0]) if args else None
+    main(limit=limit, cascade="--cascade" in sys.argv[1:])
@@ -0,0 +1,106 @@
+"""
+Provider cascade for adjudication.
+Each item is first sent to the cheapest provider (GPT-4o-mini). If it answers with High confidence
+and the item does not look difficult, its definition is kept as the adjudicated one and the other providers
+are never called. Otherwise the item is escalated: Llama-3.3-70b and Deepseek-r1-70b generate their definitions
+and the three are adjudicated by Claude Sonnet 4 as in adjudicate_definitions.
+"""
+
+import asyncio
+from aiolimiter import AsyncLimiter
+import generate_definitions_with_gpt4o as gpt4o
+import generate_definitions_with_groq as groq
+from adjudicate_definitions import adjudicate_definitions, fallback_definition, get_confidence_level
+from providers import LLAMA_MODEL, DEEPSEEK_MODEL, PROVIDER_RPM, MAX_CONCURRENCY
+
+# Difficulty heuristics: items with more paragraphs, or whose GPT-4o-mini definition is longer,
+# are escalated even when GPT-4o-mini is confident. Tune them with the escalation rate printed by
+# adjudicate_definitions.main(cascade=True).
+MAX_EASY_PARAGRAPHS = 5
+MAX_EASY_DEFINITION_WORDS = 80
+
+# One rate limiter per provider, shared by all the items of a run (only held around the API requests, not cache hits)
+_limiters = {name: AsyncLimiter(rpm, 60) for name, rpm in PROVIDER_RPM.items()}
+
+
+def is_easy(item, definition):
+    """
+    Check whether the GPT-4o-mini definition can be kept without escalation:
+    High confidence, a non-empty definition, and an item that does not look difficult.
+    """
+    text = definition.get("definition", "").strip()
+    return (get_confidence_level(definition.get("confidence")) == 3
+            and bool(text)
+            and len(item.get("paragraphs", [])) <= MAX_EASY_PARAGRAPHS
+            and len(text.split()) <= MAX_EASY_DEFINITION_WORDS)
+
+
+async def _generate_groq(item, name, model, session):
+    return await groq.generate_definition_for_item(item, model=model, session=session, throttle=_limiters[name])
+
+
+async def adjudicate_cascade(item, session=None):
+    """
+    Adjudicate a single item from selected.json, calling the other providers only when needed.
+    Returns the final definition dictionary (adjudication_method "single_model_high" when
+    the GPT-4o-mini definition was kept without escalation).
+    session is the Groq session (see generate_definitions_with_groq.create_session) used for the Groq requests
+    (None to open one per request).
+    """
+    key_phrase = item.get("key_phrase", "")
+
+    first = await gpt4o.generate_definition_for_item(item, throttle=_limiters["gpt4o_mini"])
+
+    if is_easy(item, first):
+        print(f"  → {key_phrase}: GPT-4o-mini has High confidence. Keeping its definition...")
+        return {
+            "key_phrase": key_phrase,
+            "definition": first.get("definition", ""),
+            "reasoning": first.get("reasoning", ""),
+            "confidence": "High (Single model)",
+            "adjudication_method": "single_model_high",
+            "models_used": [first.get("model")],
+            "act_url": first.get("act_url", ""),
+            "paragraphs_urls": first.get("paragraphs_urls", []),
+        }
+
+    print(f"  → {key_phrase}: GPT-4o-mini has {first.get('confidence', 'Unknown')} confidence. Escalating...")
+    outcomes = await asyncio.gather(
+        _generate_groq(item, "llama", LLAMA_MODEL, session),
+        _generate_groq(item, "deepseek", DEEPSEEK_MODEL, session),
+        return_exceptions=True
+    )
+
+    definitions = [first]
+    for model, outcome in zip((LLAMA_MODEL, DEEPSEEK_MODEL), outcomes):
+        if isinstance(outcome, Exception):
+            print(f"  ✗ {model} failed for {key_phrase}: {str(outcome)}")
+            continue
+        definitions.append(outcome)
+
+    try:
+        return await asyncio.to_thread(adjudicate_definitions, item, definitions)
+    except Exception as e:
+        print(f"  ✗ Error adjudicating {key_phrase}: {str(e)}")
+        # Use first available definition as fallback (adjudicated again on the next run)
+        return fallback_definition(definitions[0])
+
+
+async def adjudicate_all(items, on_result=None, max_concurrency=MAX_CONCURRENCY):
+    """
+    Run the cascade over several items concurrently.
+    on_result, if given, is called with each final definition as soon as it is available.
+    Returns one final definition (or exception) per item, in the same order as items.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    # Llama and Deepseek requests of all items share one Groq session (up to two per item in flight)
+    async with groq.create_session(max_connections=2 * max_concurrency) as session:
+        async def process(item):
+            async with semaphore:
+                result = await adjudicate_cascade(item, session=session)
+            if on_result:
+                on_result(result)
+            return result
+
+        return await asyncio.gather(*(process(item) for item in items), return_exceptions=True)
@@ -0,0 +1,26 @@
+"""
+argparse types shared by the command-line scripts, so invalid values are rejected with a usage error
+instead of failing (or silently misbehaving) later in the run.
+"""
+
+import argparse
+
+
+def int_at_least(minimum):
+    """argparse type for integer options that must be at least minimum"""
+    def parse(value):
+        try:
+            number = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"must be an integer, got {value!r}")
+        if number < minimum:
+            raise argparse.ArgumentTypeError(f"must be at least {minimum}, got {value}")
+        return number
+    return parse
+
+
+# Concurrency, rate and batch size options
+positive_int = int_at_least(1)
+
+# Limits, where 0 means no limit
+non_negative_int = int_at_least(0)
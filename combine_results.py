@@ -5,7 +5,7 @@ Script to combine all results from different stages:
 Combines them into a comprehensive output file.
 """
 
-import json
+import orjson
 import os
 from datetime import datetime
 
@@ -38,8 +38,8 @@ def combine_results(gpt4o_file='definitions_gpt4o_mini.json',
     for name, filepath in files_to_load.items():
         if os.path.exists(filepath):
             try:
-                with open(filepath, 'r', encoding='utf-8') as f:
-                    loaded_data[name] = json.load(f)
+                with open(filepath, 'rb') as f:
+                    loaded_data[name] = orjson.loads(f.read())
                 print(f"  ✓ Loaded {name}: {len(loaded_data[name])} definitions")
             except Exception as e:
                 print(f"  ✗ Error loading {name} from {filepath}: {str(e)}")
@@ -48,64 +48,35 @@ def combine_results(gpt4o_file='definitions_gpt4o_mini.json',
             print(f"  ⚠ File not found: {filepath}")
             loaded_data[name] = []
     
-    # Create dictionaries keyed by key_phrase
-    gpt4o_dict = {d.get("key_phrase"): d for d in loaded_data.get("gpt4o_mini", [])}
-    llama_dict = {d.get("key_phrase"): d for d in loaded_data.get("llama", [])}
-    deepseek_dict = {d.get("key_phrase"): d for d in loaded_data.get("deepseek", [])}
-    adjudicated_dict = {d.get("key_phrase"): d for d in loaded_data.get("adjudicated", [])}
+    # Merge in priority order: the adjudicated result wins, otherwise the first model that has the key phrase.
+    # Recovery strategy: if a key phrase is not in the adjudicated results, we take the first occurrence found in any of the other models.
+    # Within one file the last entry for a key phrase wins, hence the reversed scan.
+    merged = {}
+    for name in ("adjudicated", "gpt4o_mini", "llama", "deepseek"):
+        for d in reversed(loaded_data[name]):
+            key_phrase = d.get("key_phrase")
+            if key_phrase and key_phrase not in merged:
+                merged[key_phrase] = {
+                    "key_phrase": key_phrase,
+                    "definition": d.get("definition", ""),
+                    "reasoning": d.get("reasoning", ""),
+                    "act_url": d.get("act_url", ""),
+                    "paragraphs_urls": d.get("paragraphs_urls", ""),
+                }
     
-    # Get all unique key phrases
-    all_key_phrases = set()
-    all_key_phrases.update(gpt4o_dict.keys())
-    all_key_phrases.update(llama_dict.keys())
-    all_key_phrases.update(deepseek_dict.keys())
-    all_key_phrases.update(adjudicated_dict.keys())
+    print(f"\nCombining results for {len(merged)} unique key phrases...")
+    results = [merged[key_phrase] for key_phrase in sorted(merged)]
     
-    print(f"\nCombining results for {len(all_key_phrases)} unique key phrases...")
-
-    # Combine results
-    results = []
-    for key_phrase in sorted(all_key_phrases):
-        combined_item = {
-            "key_phrase": key_phrase
-        }
-        
-        # Add adjudicated result
-        if key_phrase in adjudicated_dict:
-            adj = adjudicated_dict[key_phrase]
-            combined_item["definition"] = adj.get("definition", "")
-            combined_item["reasoning"] = adj.get("reasoning", "")
-            combined_item["act_url"] = adj.get("act_url", "")
-            combined_item["paragraphs_urls"] = adj.get("paragraphs_urls", "")
-        #Recovery strategy: if a key phrase is not in the adjudicated results, we take the first occurrence found in any of the other models.
-        elif key_phrase in gpt4o_dict:
-            combined_item["definition"] = gpt4o_dict[key_phrase].get("definition", "")
-            combined_item["reasoning"] = gpt4o_dict[key_phrase].get("reasoning", "")
-            combined_item["act_url"] = gpt4o_dict[key_phrase].get("act_url", "")
-            combined_item["paragraphs_urls"] = gpt4o_dict[key_phrase].get("paragraphs_urls", "")
-        elif key_phrase in llama_dict:
-            combined_item["definition"] = llama_dict[key_phrase].get("definition", "")
-            combined_item["reasoning"] = llama_dict[key_phrase].get("reasoning", "")
-            combined_item["act_url"] = llama_dict[key_phrase].get("act_url", "")
-            combined_item["paragraphs_urls"] = llama_dict[key_phrase].get("paragraphs_urls", "")
-        elif key_phrase in deepseek_dict:
-            combined_item["definition"] = deepseek_dict[key_phrase].get("definition", "")
-            combined_item["reasoning"] = deepseek_dict[key_phrase].get("reasoning", "")
-            combined_item["act_url"] = deepseek_dict[key_phrase].get("act_url", "")
-            combined_item["paragraphs_urls"] = deepseek_dict[key_phrase].get("paragraphs_urls", "")            
-        results.append(combined_item)
-        
-
     # Save combined results
     print(f"\nSaving combined results to {output_file}...")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    with open(output_file, 'wb') as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
     
     print(f"✓ Combined {len(results)} definitions")
-    print(f"  - GPT-4o-mini: {len(gpt4o_dict)}")
-    print(f"  - Llama-3.3-70b: {len(llama_dict)}")
-    print(f"  - Deepseek-r1-70b: {len(deepseek_dict)}")
-    print(f"  - Adjudicated: {len(adjudicated_dict)}")
+    print(f"  - GPT-4o-mini: {len(loaded_data['gpt4o_mini'])}")
+    print(f"  - Llama-3.3-70b: {len(loaded_data['llama'])}")
+    print(f"  - Deepseek-r1-70b: {len(loaded_data['deepseek'])}")
+    print(f"  - Adjudicated: {len(loaded_data['adjudicated'])}")
     
     return results
 
@@ -0,0 +1,118 @@
+"""
+Prompts and output records shared by the scripts generating definitions.
+Every model is sent the same prompt for an item (prompt.txt followed by the key legal term,
+the URL of the UK act and the cleaned case law paragraphs), rendered here so the prompts cannot drift apart.
+"""
+
+from preprocess_selected import cleaned_paragraph_text
+
+
+def load_prompt_template():
+    """Load the prompt template from prompt.txt"""
+    try:
+        with open('prompt.txt', 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        raise FileNotFoundError("prompt.txt file not found!")
+
+
+# The template is read once at import instead of once per item
+PROMPT_TEMPLATE = load_prompt_template()
+
+# Appended to the prompt template when several items are sent in one request
+BATCH_INSTRUCTION = (
+    "The input below contains {count} items, each introduced by \"Item #N\" and separated by \"---\". "
+    "Apply the instructions above to each item independently and return a JSON object whose "
+    "\"definitions\" array contains exactly one object per item, in the same order as the items."
+)
+
+
+def get_act_url(item):
+    """URL of the UK act the term is taken from (empty if the item has no legislation URL)"""
+    legislation_urls = item.get("legislation_urls", [])
+    if legislation_urls:
+        # Truncate URL at "/section"
+        return legislation_urls[0].split("/section")[0]
+    return ""
+
+
+def paragraphs_urls(item):
+    """Case law URLs of the paragraphs of an item, as stored in its output record"""
+    return [p.get("case_law_url", "") for p in item.get("paragraphs", [])]
+
+
+def _append_item_prompt(parts, item):
+    """Append the per-item part of the prompt (key legal term, act URL and paragraphs) to parts"""
+    # Add key legal term
+    parts.append(f"Key legal term: {item.get('key_phrase', '')}\n\n")
+
+    # Add UK act URL (if exists)
+    parts.append(f"URL of the UK act from which the term is taken: {get_act_url(item)}\n\n")
+
+    # Add paragraphs
+    for i, paragraph in enumerate(item.get("paragraphs", []), start=1):
+        cleaned_text = cleaned_paragraph_text(paragraph)
+        parts.append(f"Paragraph #{i}: {cleaned_text}\n\n")
+
+
+def item_prompt(item):
+    """The per-item part of the prompt, sent after the template"""
+    parts = []
+    _append_item_prompt(parts, item)
+    return "".join(parts)
+
+
+def build_prompt(item, template=PROMPT_TEMPLATE):
+    """Prompt for a single item: the template followed by the item"""
+    # The template comes first so the providers' automatic prompt caching can reuse it across requests
+    parts = [template, "\n\n"]
+    _append_item_prompt(parts, item)
+    return "".join(parts)
+
+
+def build_batch_prompt(items, template=PROMPT_TEMPLATE, instruction=BATCH_INSTRUCTION):
+    """
+    Prompt for several items answered by one request: the template and the batch instruction are sent once,
+    followed by the items, each introduced by "Item #N" and separated by "---"
+    """
+    parts = [template, "\n\n", instruction.format(count=len(items)), "\n\n"]
+    for n, item in enumerate(items, start=1):
+        if n > 1:
+            parts.append("---\n\n")
+        parts.append(f"Item #{n}\n\n")
+        _append_item_prompt(parts, item)
+    return "".join(parts)
+
+
+def build_result(item, definition_json, model):
+    """
+    Build the output record for an item from the definition returned by the model.
+    Paragraph texts are not copied into the record; they can be looked up in selected.json.
+    """
+    return {
+        "key_phrase": item.get("key_phrase", ""),
+        "definition": definition_json.get("definition", ""),
+        "reasoning": definition_json.get("reasoning", ""),
+        "confidence": definition_json.get("confidence", "Low"),
+        "model": model,
+        "act_url": get_act_url(item),
+        "paragraphs_urls": paragraphs_urls(item),
+    }
+
+
+def resume_key(key_phrase, urls):
+    """
+    Identify an item and its output record when resuming: key phrase and paragraph URLs,
+    so items sharing a key phrase (e.g. duplicates with their own paragraph URLs) are told apart
+    """
+    return key_phrase, tuple(urls)
+
+
+def item_resume_key(item):
+    """resume_key of an item from selected.json"""
+    return resume_key(item.get("key_phrase", ""), paragraphs_urls(item))
+
+
+def record_resume_key(record):
+    """resume_key of an output record"""
+    return resume_key(record.get("key_phrase"), record.get("paragraphs_urls", []))
@@ -0,0 +1,41 @@
+"""
+JSON schemas for the structured responses requested from the models.
+Used as the OpenAI json_schema response format and as the Claude tool input schema,
+so responses are always well-formed JSON objects with the expected fields.
+"""
+
+# Response to prompt.txt: a generated definition with a confidence level
+DEFINITION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "key_legal_term": {"type": "string"},
+        "definition": {"type": "string"},
+        "reasoning": {"type": "string"},
+        "confidence": {"type": "string", "enum": ["Low", "Medium", "High"]},
+    },
+    "required": ["key_legal_term", "definition", "reasoning", "confidence"],
+    "additionalProperties": False,
+}
+
+# Response to prompt.txt when several items are sent in one request: one definition per item, in order
+# (OpenAI structured outputs require an object at the top level, hence the wrapping "definitions" field)
+DEFINITION_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "definitions": {"type": "array", "items": DEFINITION_SCHEMA},
+    },
+    "required": ["definitions"],
+    "additionalProperties": False,
+}
+
+# Response to prompt_for_ajudication.txt: the definition selected among those provided
+SELECTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "key_legal_term": {"type": "string"},
+        "definition": {"type": "string"},
+        "reasoning": {"type": "string"},
+    },
+    "required": ["key_legal_term", "definition", "reasoning"],
+    "additionalProperties": False,
+}
@@ -4,14 +4,17 @@ Reads final_dataser_of_key_phrases.csv, groups by legislation_term and legislati
 and generates definitions based on section_text and case law paragraphs.
 """
 
-import re
 import os
 import pandas as pd
-import json
+import orjson
 import logging
 from datetime import datetime
 from dotenv import load_dotenv
 from anthropic import Anthropic
+import llm_cache
+from json_stream import iter_items
+from definition_prompt import PROMPT_TEMPLATE, get_act_url, item_prompt, paragraphs_urls
+from definition_schema import DEFINITION_SCHEMA
 import time
 
 # Load environment variables
@@ -25,16 +28,7 @@ if not api_key:
 
 client = Anthropic(api_key=api_key)
 
-# Read the prompt template
-def load_prompt_template():
-    """Load the prompt template from prompt.txt"""
-    try:
-        with open('prompt.txt', 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        logger.error("prompt.txt file not found!")
-        raise
-
+CLAUDE_MODEL = "claude-sonnet-4-20250514"
 
 def format_case_law_paragraphs(group_df):
     """
@@ -61,35 +55,58 @@ def get_case_terms(group_df):
     return ", ".join(case_terms) if case_terms else "None identified"
 
 
-def call_claude_sonnet(prompt_text):
+def call_claude_sonnet(template, prompt_tail, schema=DEFINITION_SCHEMA, tool_name="emit_definition"):
     """
-    Call Claude Sonnet API with the prompt and return the response.
+    Call Claude Sonnet API with the prompt and return the response as a dictionary.
+    Claude is forced to answer through a tool whose input schema is the expected JSON object,
+    so the response never needs to be parsed from free text.
+    The prompt is the template followed by the per-item tail. The template block is marked for
+    Anthropic prompt caching, so its tokens are reused across calls instead of being reprocessed.
+    Responses are served from the on-disk cache when the same prompt was already sent.
     """
+    template_block = template + "\n\n"
+    prompt_text = template_block + prompt_tail
+    cached = llm_cache.get(CLAUDE_MODEL, prompt_text)
+    if cached is not None:
+        return orjson.loads(cached)
+    
     try:
         message = client.messages.create(
-            model="claude-sonnet-4-20250514",
+            model=CLAUDE_MODEL,
             max_tokens=4096,
+            tools=[{
+                "name": tool_name,
+                "description": "Return the JSON object requested in the prompt.",
+                "input_schema": schema
+            }],
+            tool_choice={"type": "tool", "name": tool_name},
             messages=[
-                {"role": "user", "content": prompt_text}
+                {"role": "user", "content": [
+                    {"type": "text", "text": template_block, "cache_control": {"type": "ephemeral"}},
+                    {"type": "text", "text": prompt_tail}
+                ]}
             ]
         )
         
-        # Extract text from response
-        response_text = ""
-        for content_block in message.content:
-            if content_block.type == "text":
-                response_text += content_block.text
-        
-        return response_text.strip()
+        response_json = message.content[0].input
     
     except Exception as e:
         print(f"Error calling Claude API: {str(e)}")
         raise
+    
+    llm_cache.put(CLAUDE_MODEL, prompt_text, orjson.dumps(response_json).decode('utf-8'))
+    return response_json
 
 def json_to_excel():
     # Load JSON data
-    with open("tovalidate.json", "r", encoding="utf-8") as f:
-        data = json.load(f)
+    with open("tovalidate.json", 'rb') as f:
+        data = orjson.loads(f.read())
+
+    # Paragraph texts are not stored in tovalidate.json, look them up once in selected.json
+    paragraphs_texts = {
+        item.get("key_phrase", ""): [p.get("paragraph_text", "") for p in item.get("paragraphs", [])]
+        for item in iter_items('selected.json')
+    }
 
     rows = []
 
@@ -100,6 +117,10 @@ def json_to_excel():
             if key in {"act_url", "paragraphs_urls"}:
                 continue
             row[key] = value
+
+        # Add paragraphs texts dynamically: paragraphs_texts_1, paragraphs_texts_2, etc.
+        for idx, para_text in enumerate(paragraphs_texts.get(item.get("key_phrase", ""), []), start=1):
+            row[f"paragraphs_texts_{idx}"] = para_text
         rows.append(row)
 
     # Create DataFrame
@@ -116,78 +137,33 @@ def main():
     """
     Main function to process the CSV and generate definitions.
     """
-    
-    # Load prompt template
-    prompt_template = load_prompt_template()
 
     print("\n\n\n")
-    with open('selected.json', 'r', encoding='utf-8') as f:
-        data = json.load(f)
 
     results = []  # Array to store all the JSON objects
-    for item in data:
-        tosendtoclaude = prompt_template + "\n\n"
-
-        # Add key legal term
-        key_phrase = item.get("key_phrase", "")
-        tosendtoclaude += f"Key legal term: {key_phrase}\n\n"
-
-        # Add UK act URL (if exists)
-        legislation_urls = item.get("legislation_urls", [])
-        act_url = ""
-        if legislation_urls:
-            # Truncate URL at "/section"
-            act_url = legislation_urls[0].split("/section")[0]
-        tosendtoclaude += f"URL of the UK act from which the term is taken: {act_url}\n\n"
-
-        # Add paragraphs
-        paragraphs_urls = []
-        paragraphs_texts = []
-        for i, paragraph in enumerate(item.get("paragraphs", []), start=1):
-            text = paragraph.get("paragraph_text", "")
-            cleaned_text = re.sub(r'\s+', ' ', text).strip()
-            tosendtoclaude += f"Paragraph #{i}: {cleaned_text}\n\n"
-
-            # Collect paragraph URLs and texts
-            paragraphs_urls.append(paragraph.get("case_law_url", ""))
-            paragraphs_texts.append(text)
-
-        # Call Claude function to get definition JSON string
-        definition_str = call_claude_sonnet(tosendtoclaude)
-
-        # Convert string to JSON object
-        #definition_json = json.loads(definition_str)
-        
-        try:
-            definition_json = json.loads(definition_str)
-        except json.JSONDecodeError as e:
-            print("JSON decoding failed!")
-            print("Key phrase causing the error:", key_phrase)
-            print("Current contents of results:")
-            print(json.dumps(results, ensure_ascii=False, indent=2))
-            with open("tovalidate.json", "w", encoding="utf-8") as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
-            json_to_excel()
-            raise  # re-raise the exception so you still see the full traceback
+    # Items are streamed from selected.json, so the first request is sent without waiting for the whole file
+    for item in iter_items('selected.json'):
+        # Key legal term, UK act URL and paragraphs, as sent to the other models
+        tosendtoclaude = item_prompt(item)
+
+        # Call Claude function to get the definition as a JSON object
+        definition_json = call_claude_sonnet(PROMPT_TEMPLATE, tosendtoclaude)
 
         # Build the final JSON object in the required format
+        # (paragraph texts are looked up in selected.json when exporting to Excel)
         final_obj = {
-            "key_phrase": definition_json.get("key legal term", ""),
+            "key_phrase": item.get("key_phrase", ""),
             "definition": definition_json.get("definition", ""),
             "reasoning": definition_json.get("reasoning", ""),
-            "act_url": act_url,
-            "paragraphs_urls": paragraphs_urls,
+            "act_url": get_act_url(item),
+            "paragraphs_urls": paragraphs_urls(item),
         }
 
-        # Add paragraphs texts dynamically: paragraphs_texts_1, paragraphs_texts_2, etc.
-        for idx, para_text in enumerate(paragraphs_texts, start=1):
-            final_obj[f"paragraphs_texts_{idx}"] = para_text
-
         # Append to results array
         results.append(final_obj)
 
-    with open("tovalidate.json", "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    with open("tovalidate.json", 'wb') as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
 
     json_to_excel()
 
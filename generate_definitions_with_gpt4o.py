@@ -3,12 +3,20 @@ Script to generate definitions for legislation terms using GPT-4o-mini API.
 Processes items from selected.json and generates definitions with confidence levels.
 """
 
-import re
 import os
-import json
+import hashlib
+import contextlib
+import orjson
+import asyncio
+from itertools import islice
 from dotenv import load_dotenv
-from openai import OpenAI
-import time
+from openai import AsyncOpenAI
+import llm_cache
+from throttle import Throttle
+from json_stream import JsonObjectScanner, iter_items, load_json_list, atomic_write_json
+from definition_prompt import build_prompt, build_batch_prompt, build_result, get_act_url, paragraphs_urls, \
+    item_resume_key, record_resume_key
+from definition_schema import DEFINITION_SCHEMA, DEFINITION_BATCH_SCHEMA
 
 # Load environment variables
 load_dotenv()
@@ -18,143 +26,285 @@ api_key = os.getenv('OPENAI_API_KEY')
 if not api_key:
     raise ValueError("OPENAI_API_KEY not found in .env file. Please add it.")
 
-client = OpenAI(api_key=api_key)
+client = AsyncOpenAI(api_key=api_key)
 
-def load_prompt_template():
-    """Load the prompt template from prompt.txt"""
+MODEL_NAME = "gpt-4o-mini"
+
+# Concurrency defaults: requests in flight at once and requests per minute
+MAX_CONCURRENCY = 10
+REQUESTS_PER_MINUTE = 500
+
+# Number of completed items between two checkpoint writes of the output file
+CHECKPOINT_EVERY = 10
+
+
+async def _stream_gpt4o_mini_json(prompt_text, schema, schema_name):
+    """
+    Stream a GPT-4o-mini response and stop reading as soon as the JSON object is complete.
+    The response is constrained server-side to the given JSON schema.
+    """
+    scanner = JsonObjectScanner()
+    stream = await client.chat.completions.create(
+        model=MODEL_NAME,
+        messages=[
+            {"role": "user", "content": prompt_text}
+        ],
+        max_tokens=4096,
+        temperature=0.7,
+        response_format={
+            "type": "json_schema",
+            "json_schema": {"name": schema_name, "schema": schema, "strict": True}
+        },
+        stream=True
+    )
     try:
-        with open('prompt.txt', 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        raise FileNotFoundError("prompt.txt file not found!")
+        async for chunk in stream:
+            if not chunk.choices or not chunk.choices[0].delta.content:
+                continue
+            if scanner.feed(chunk.choices[0].delta.content):
+                break
+    finally:
+        await stream.close()
+    return scanner
 
 
-def call_gpt4o_mini(prompt_text):
+async def call_gpt4o_mini(prompt_text, schema=DEFINITION_SCHEMA, schema_name="definition", throttle=None):
     """
     Call GPT-4o-mini API with the prompt and return the response.
+    Responses are served from the on-disk cache when the same prompt was already sent.
+    The throttle (see throttle.py), if given, is only held around the API request, so cache hits never wait for it.
     """
+    cached = llm_cache.get(MODEL_NAME, prompt_text)
+    if cached is not None:
+        return cached
+    
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "user", "content": prompt_text}
-            ],
-            max_tokens=4096,
-            temperature=0.7
-        )
-        
-        return response.choices[0].message.content.strip()
+        async with throttle or contextlib.nullcontext():
+            scanner = await _stream_gpt4o_mini_json(prompt_text, schema, schema_name)
+        response_text = scanner.text
     
     except Exception as e:
         print(f"Error calling GPT-4o-mini API: {str(e)}")
         raise
+    
+    llm_cache.put_valid(MODEL_NAME, prompt_text, response_text)
+    return response_text
+
+
+def _parse_response(definition_str, key_phrases):
+    """Parse the JSON returned by GPT-4o-mini, reporting which key phrases it was for on failure"""
+    try:
+        return orjson.loads(definition_str)
+    except orjson.JSONDecodeError as e:
+        print(f"JSON decoding failed for key phrase: {', '.join(key_phrases)}")
+        print(f"Response: {definition_str[:500]}...")
+        raise
 
 
-def generate_definition_for_item(item):
+async def generate_definition_for_item(item, throttle=None):
     """
     Generate definition for a single item from selected.json
     Returns a dictionary with the definition and metadata
+    throttle is held around the API request, not around cache hits (see call_gpt4o_mini)
     """
-    # Load prompt template
-    prompt_template = load_prompt_template()
-    
-    prompt_text = prompt_template + "\n\n"
-    
-    # Add key legal term
-    key_phrase = item.get("key_phrase", "")
-    prompt_text += f"Key legal term: {key_phrase}\n\n"
-    
-    # Add UK act URL (if exists)
-    legislation_urls = item.get("legislation_urls", [])
-    act_url = ""
-    if legislation_urls:
-        # Truncate URL at "/section"
-        act_url = legislation_urls[0].split("/section")[0]
-    prompt_text += f"URL of the UK act from which the term is taken: {act_url}\n\n"
-    
-    # Add paragraphs
-    paragraphs_urls = []
-    paragraphs_texts = []
-    for i, paragraph in enumerate(item.get("paragraphs", []), start=1):
-        text = paragraph.get("paragraph_text", "")
-        cleaned_text = re.sub(r'\s+', ' ', text).strip()
-        prompt_text += f"Paragraph #{i}: {cleaned_text}\n\n"
-        
-        # Collect paragraph URLs and texts
-        paragraphs_urls.append(paragraph.get("case_law_url", ""))
-        paragraphs_texts.append(text)
-    
     # Call GPT-4o-mini to get definition JSON string
-    definition_str = call_gpt4o_mini(prompt_text)
+    definition_str = await call_gpt4o_mini(build_prompt(item), throttle=throttle)
+    definition_json = _parse_response(definition_str, [item.get("key_phrase", "")])
     
-    # Parse JSON response
-    try:
-        definition_json = json.loads(definition_str)
-    except json.JSONDecodeError as e:
-        print(f"JSON decoding failed for key phrase: {key_phrase}")
-        print(f"Response: {definition_str[:500]}...")
-        raise
-    
-    # Build the result object
-    result = {
-        "key_phrase": definition_json.get("key legal term", key_phrase),
-        "definition": definition_json.get("definition", ""),
-        "reasoning": definition_json.get("reasoning", ""),
-        "confidence": definition_json.get("confidence", "Low"),
-        "model": "gpt-4o-mini",
-        "act_url": act_url,
-        "paragraphs_urls": paragraphs_urls,
-    }
+    return build_result(item, definition_json, MODEL_NAME)
+
+
+async def generate_definitions_batch(items, throttle=None):
+    """
+    Generate definitions for several items from selected.json with a single request.
+    The prompt template is sent once, followed by all the items, and the model returns one definition per item.
+    Returns the result dictionaries in the same order as items.
+    throttle is held around the API request, not around cache hits (see call_gpt4o_mini)
+    """
+    # Call GPT-4o-mini to get the definitions JSON string
+    key_phrases = [item.get("key_phrase", "") for item in items]
+    definitions_str = await call_gpt4o_mini(build_batch_prompt(items), schema=DEFINITION_BATCH_SCHEMA, schema_name="definitions",
+                                            throttle=throttle)
+    definitions = _parse_response(definitions_str, key_phrases).get("definitions", [])
     
-    # Add paragraphs texts dynamically
-    for idx, para_text in enumerate(paragraphs_texts, start=1):
-        result[f"paragraphs_texts_{idx}"] = para_text
+    if len(definitions) != len(items):
+        raise ValueError(f"Expected {len(items)} definitions, got {len(definitions)}")
+    # The definitions are matched to the items by position, so check the model kept the order
+    for key_phrase, definition_json in zip(key_phrases, definitions):
+        if definition_json.get("key_legal_term", "").strip().casefold() != key_phrase.strip().casefold():
+            raise ValueError(f"Definition for '{definition_json.get('key_legal_term', '')}' returned in place of '{key_phrase}'")
     
-    return result
+    return [build_result(item, definition_json, MODEL_NAME) for item, definition_json in zip(items, definitions)]
+
+
+def _content_hash(item):
+    """
+    Hash of what the definition of an item depends on: key phrase, act URL and paragraph texts
+    (sorted, so the same paragraphs in a different order give the same hash)
+    """
+    texts = sorted(p.get("paragraph_text", "") for p in item.get("paragraphs", []))
+    content = orjson.dumps([item.get("key_phrase", ""), get_act_url(item), texts], option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(content).hexdigest()
 
 
-def main(input_file='selected.json', output_file='definitions_gpt4o_mini.json', limit=None):
+async def main(input_file='selected.json', output_file='definitions_gpt4o_mini.json', limit=None,
+               max_concurrency=MAX_CONCURRENCY, rpm=REQUESTS_PER_MINUTE, batch_size=1, data=None):
     """
     Main function to process selected.json and generate definitions using GPT-4o-mini.
+    Items are streamed from input_file and dispatched as they are parsed, so requests start
+    before the whole file is read and only the batches in flight are held in memory.
+    The requests actually sent (cache hits are not) are bounded by max_concurrency and rate limited to rpm.
+    Items already in output_file (same key phrase and paragraph URLs) are skipped, so an interrupted run can be resumed.
+    Items with the same key phrase, act URL and paragraph texts as an earlier item are not sent again:
+    they get a copy of the earlier definition with their own paragraph URLs.
     
     Args:
         input_file: Path to input JSON file
         output_file: Path to output JSON file
         limit: Number of items to process (None for all)
+        max_concurrency: Maximum number of requests in flight at once
+        rpm: Maximum number of requests per minute
+        batch_size: Number of items sent in a single request (1 for one request per item).
+                    If a batch request fails, its items are retried one request per item.
+        data: Items to process, already loaded (input_file is not read if given)
     """
-    print(f"Loading data from {input_file}...")
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    if data is not None:
+        items = iter(data)
+    else:
+        print(f"Streaming data from {input_file}...")
+        items = iter_items(input_file)
     
     # Limit to first N items if specified
     if limit:
-        data = data[:limit]
+        items = islice(items, limit)
         print(f"Processing first {limit} items...")
     
-    results = []
-    total = len(data)
+    # Resume: keep definitions from a previous run and skip their items. Items are identified by
+    # key phrase and paragraph URLs, so duplicates (same key phrase, other URLs) not yet written are not skipped
+    results = load_json_list(output_file)
+    if results:
+        done = {record_resume_key(d) for d in results}
+        items = (item for item in items if item_resume_key(item) not in done)
+        print(f"Resuming: {len(results)} definitions already in {output_file}, skipping their items")
+    
+    # Deduplicate: only the first item with a given content is sent, later ones reuse its definition
+    # with their own paragraph URLs. pending_duplicates holds the duplicates of the items whose definition
+    # is not generated yet, generated the definitions already generated, by content hash
+    pending_duplicates = {}
+    generated = {}
+    item_count = 0
+    duplicate_count = 0
+    
+    # Position of each item in the input (by id, an item is referenced until its record is written),
+    # so the output file keeps the input order
+    positions = {}
+    completed = []
+    checkpointed = 0
+    
+    def checkpoint():
+        nonlocal checkpointed
+        if len(completed) - checkpointed >= CHECKPOINT_EVERY:
+            atomic_write_json(output_file, results + [result for _, result in completed])
+            checkpointed = len(completed)
+    
+    def record_duplicate(duplicate, result):
+        completed.append((positions[id(duplicate)], dict(result, paragraphs_urls=paragraphs_urls(duplicate))))
+    
+    def unique(items):
+        nonlocal item_count, duplicate_count
+        for item in items:
+            positions[id(item)] = item_count
+            item_count += 1
+            content_hash = _content_hash(item)
+            if content_hash in generated:
+                duplicate_count += 1
+                record_duplicate(item, generated[content_hash])
+                checkpoint()
+            elif content_hash in pending_duplicates:
+                duplicate_count += 1
+                pending_duplicates[content_hash].append(item)
+            else:
+                pending_duplicates[content_hash] = []
+                yield item
     
-    for idx, item in enumerate(data, 1):
-        key_phrase = item.get("key_phrase", "")
-        print(f"\n[{idx}/{total}] Processing: {key_phrase}")
+    items = unique(items)
+    
+    throttle = Throttle(max_concurrency, rpm)
+    
+    def record(item, result):
+        print(f"✓ [{len(completed) + 1}] Generated definition for {result['key_phrase']} "
+              f"with confidence: {result.get('confidence', 'Unknown')}")
+        completed.append((positions[id(item)], result))
         
+        # One output record per duplicate item, with its own paragraph URLs
+        content_hash = _content_hash(item)
+        generated[content_hash] = result
+        for duplicate in pending_duplicates.pop(content_hash, []):
+            record_duplicate(duplicate, result)
+        checkpoint()
+    
+    async def process_item(item):
+        print(f"\nProcessing: {item.get('key_phrase', '')}")
         try:
-            result = generate_definition_for_item(item)
-            results.append(result)
-            print(f"✓ Generated definition with confidence: {result.get('confidence', 'Unknown')}")
-            
-            # Small delay to avoid rate limiting
-            time.sleep(1)
-            
-        except Exception as e:
-            print(f"✗ Error processing {key_phrase}: {str(e)}")
-            # Continue with next item
-            continue
+            result = await generate_definition_for_item(item, throttle=throttle)
+        except Exception:
+            # The duplicates waiting for this definition are dropped too; later ones are sent on their own
+            dropped = pending_duplicates.pop(_content_hash(item), [])
+            if dropped:
+                print(f"✗ Skipping {len(dropped)} duplicate(s) of {item.get('key_phrase', '')}, "
+                      f"its definition could not be generated")
+            raise
+        record(item, result)
+        return result
+    
+    async def process_batch(batch):
+        """Process a batch of items, returning one result (or exception) per item"""
+        if len(batch) > 1:
+            print(f"\nProcessing batch: {', '.join(item.get('key_phrase', '') for item in batch)}")
+            try:
+                batch_results = await generate_definitions_batch(batch, throttle=throttle)
+            except Exception as e:
+                print(f"⚠ Batch request failed ({str(e)}), falling back to one request per item")
+            else:
+                for item, result in zip(batch, batch_results):
+                    record(item, result)
+                return batch_results
+        
+        return await asyncio.gather(*(process_item(item) for item in batch), return_exceptions=True)
+    
+    async def run_batch(batch):
+        return batch, await process_batch(batch)
+    
+    # Schedule batches as they are parsed, keeping at most max_concurrency of them pending
+    pending = set()
+    finished = []
+    batches = iter(lambda: list(islice(items, batch_size)), [])
+    for batch in batches:
+        if len(pending) >= max_concurrency:
+            done_tasks, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            finished.extend(task.result() for task in done_tasks)
+        pending.add(asyncio.create_task(run_batch(batch)))
+    if pending:
+        done_tasks, _ = await asyncio.wait(pending)
+        finished.extend(task.result() for task in done_tasks)
+    
+    # Failed items are skipped, the rest of their batch is kept
+    for batch, outcomes in finished:
+        for item, outcome in zip(batch, outcomes):
+            if isinstance(outcome, Exception):
+                print(f"✗ Error processing {item.get('key_phrase', '')}: {str(outcome)}")
+    
+    # Keep the input order in the output file
+    completed.sort(key=lambda entry: entry[0])
+    results.extend(result for _, result in completed)
+    
+    if duplicate_count:
+        print(f"\nDeduplicated {item_count} items to {item_count - duplicate_count} requests "
+              f"({duplicate_count / item_count:.0%} duplicates)")
     
     # Save results
     print(f"\nSaving results to {output_file}...")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    atomic_write_json(output_file, results)
     
     print(f"✓ Generated {len(results)} definitions using GPT-4o-mini")
     return results
@@ -163,5 +313,6 @@ def main(input_file='selected.json', output_file='definitions_gpt4o_mini.json',
 if __name__ == "__main__":
     import sys
     limit = int(sys.argv[1]) if len(sys.argv) > 1 else None
-    main(limit=limit)
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    asyncio.run(main(limit=limit, batch_size=batch_size))
 
@@ -6,10 +6,22 @@ Processes items from selected.json and generates definitions with confidence lev
 
 import re
 import os
-import json
+import sys
+import queue
+import atexit
+import logging
+import contextlib
+from logging.handlers import QueueHandler, QueueListener
+import orjson
+import asyncio
+import aiohttp
 from dotenv import load_dotenv
-import requests
-import time
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+import llm_cache
+from json_stream import load_json_list, atomic_write_json
+from throttle import Throttle
+from definition_prompt import PROMPT_TEMPLATE, BATCH_INSTRUCTION as SHARED_BATCH_INSTRUCTION, build_prompt, \
+    build_batch_prompt, build_result, item_resume_key, record_resume_key
 
 # Load environment variables
 load_dotenv()
@@ -21,32 +33,150 @@ if not GROQ_API_KEY:
 
 GROQ_API_URL = "https://api.groq.com/openai/v1/chat/completions"
 
-def load_prompt_template():
-    """Load the prompt template from prompt.txt"""
+# Progress messages go through a queue to a background thread that writes them to stdout,
+# so the concurrent requests never wait on the console. Only this module's logger is configured,
+# the logging of the scripts importing it is left untouched.
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+logger.propagate = False
+_log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(_log_queue))
+_log_listener = QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+_log_listener.start()
+# Flush the messages still in the queue when the process exits
+atexit.register(_log_listener.stop)
+
+# Concurrency defaults: requests in flight at once and requests per minute (Groq free tier limit)
+MAX_CONCURRENCY = 5
+REQUESTS_PER_MINUTE = 30
+
+# Added to the batch instruction: Groq responses are not schema-constrained, so each definition
+# is numbered after its item to be matched to it whatever the order and the key phrases
+BATCH_INSTRUCTION = SHARED_BATCH_INSTRUCTION + (
+    " Each object also has an \"item\" field set to the number N of its item. Return only this JSON object."
+)
+
+# Idle connections to Groq are kept open this long (seconds) so later requests reuse them
+KEEPALIVE_TIMEOUT = 60
+
+# Retries of a request that was rate limited (429) or failed with a transient server error
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_ATTEMPTS = 6
+
+# Chat models sometimes wrap the JSON object in prose or code fences, and Deepseek-r1 prefixes it
+# with its reasoning in <think> tags: the reasoning is dropped and the outermost {...} block is parsed
+_THINK_RE = re.compile(r'<think>.*?</think>', re.DOTALL)
+_JSON_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+
+def extract_json(response_text):
+    """
+    Parse the JSON object in a Groq response, ignoring any text around it.
+    Raises ValueError if the response contains no valid JSON object.
+    """
+    match = _JSON_RE.search(_THINK_RE.sub('', response_text))
+    if not match:
+        raise ValueError("No JSON object found in the response")
+    return orjson.loads(match.group(0))
+
+
+def _has_json(response_text):
+    """Check whether a JSON object can be extracted from a response"""
     try:
-        with open('prompt.txt', 'r', encoding='utf-8') as f:
-            return f.read()
-    except FileNotFoundError:
-        raise FileNotFoundError("prompt.txt file not found!")
+        extract_json(response_text)
+        return True
+    except ValueError:
+        return False
 
 
-def call_groq(prompt_text, model="llama-3.3-70b-versatile"):
+def create_session(max_connections=MAX_CONCURRENCY):
+    """
+    Open the aiohttp session for Groq requests.
+    The Authorization and Content-Type headers are set once on the session, and connections are pooled
+    (at most max_connections) and kept alive, so the TCP and TLS handshakes are not repeated for every request.
+    """
+    headers = {
+        "Authorization": f"Bearer {GROQ_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    connector = aiohttp.TCPConnector(limit=max_connections, keepalive_timeout=KEEPALIVE_TIMEOUT)
+    return aiohttp.ClientSession(headers=headers, connector=connector)
+
+
+def _is_retryable(exception):
+    """Only rate limiting, transient server errors, timeouts and dropped connections are retried"""
+    if isinstance(exception, aiohttp.ClientResponseError):
+        return exception.status in RETRY_STATUSES
+    return isinstance(exception, (asyncio.TimeoutError, aiohttp.ClientConnectionError))
+
+
+def _log_retry(retry_state):
+    key_phrase = retry_state.kwargs.get("key_phrase") or "request"
+    logger.warning("⚠ Groq attempt %d/%d failed for %s (%s), retrying...",
+                   retry_state.attempt_number, MAX_ATTEMPTS, key_phrase, retry_state.outcome.exception())
+
+
+@retry(retry=retry_if_exception(_is_retryable),
+       wait=wait_random_exponential(min=1, max=60),
+       stop=stop_after_attempt(MAX_ATTEMPTS),
+       before_sleep=_log_retry,
+       reraise=True)
+async def _post_groq(session, payload, key_phrase=None, throttle=None):
+    """
+    Post a chat completion request to Groq and return the decoded JSON response.
+    Retried with jittered exponential backoff on 429/5xx responses, timeouts and connection errors.
+    The throttle (if any) is held around each attempt, so retries count against the rate limit too,
+    but not while waiting to retry.
+    """
+    async with throttle or contextlib.nullcontext():
+        async with session.post(GROQ_API_URL, json=payload,
+                                timeout=aiohttp.ClientTimeout(total=60)) as response:
+            if response.status < 400:
+                return await response.json()
+            retry_after = response.headers.get("Retry-After")
+            error = aiohttp.ClientResponseError(response.request_info, response.history,
+                                                status=response.status, message=response.reason,
+                                                headers=response.headers)
+    
+    # Honour the wait requested by Groq when rate limited, on top of the backoff
+    if response.status == 429 and retry_after:
+        try:
+            await asyncio.sleep(float(retry_after))
+        except ValueError:
+            pass
+    raise error
+
+
+async def call_groq(session, prompt_text, model="llama-3.3-70b-versatile", key_phrase=None, use_cache=True,
+                    throttle=None):
     """
     Call Groq API with the prompt and return the response.
+    Responses are served from the on-disk cache (shared with the other scripts, keyed by model and prompt)
+    when the same prompt was already sent to the same model, without waiting for the throttle.
     
     Args:
+        session: Session from create_session, shared by the requests of a run (a new one is opened for this request if None)
         prompt_text: The prompt to send
         model: Model to use - Available Groq models:
               - "llama-3.3-70b-versatile" (Llama-3-70b)
               - "deepseek-r1-distill-llama-70b" (Deepseek-r1-70b)
               Check https://console.groq.com/docs/models for exact model names.
+        key_phrase: Key phrase the prompt is for, used in retry messages
+        use_cache: If False, always call the API (the fresh response still replaces the cached one)
+        throttle: Throttle (see throttle.py) or other async context manager held around each HTTP request
+                  (None for no throttling)
     """
+    if use_cache:
+        cached = llm_cache.get(model, prompt_text)
+        if cached is not None:
+            return cached
+    
+    if session is None:
+        async with create_session(max_connections=1) as session:
+            return await call_groq(session, prompt_text, model=model, key_phrase=key_phrase, use_cache=False,
+                                   throttle=throttle)
+    
     try:
-        headers = {
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "model": model,
             "messages": [
@@ -56,18 +186,29 @@ def call_groq(prompt_text, model="llama-3.3-70b-versatile"):
             "temperature": 0.1
         }
         
-        response = requests.post(GROQ_API_URL, headers=headers, json=payload, timeout=60)
-        response.raise_for_status()
-        
-        result = response.json()
-        return result['choices'][0]['message']['content'].strip()
+        result = await _post_groq(session, payload, key_phrase=key_phrase, throttle=throttle)
+        response_text = result['choices'][0]['message']['content'].strip()
     
     except Exception as e:
-        print(f"Error calling Groq API with model {model}: {str(e)}")
+        logger.error("Error calling Groq API with model %s: %s", model, e)
         raise
+    
+    llm_cache.put_valid(model, prompt_text, response_text, is_valid=_has_json)
+    return response_text
+
 
+def _parse_response(definition_str, key_phrases):
+    """Parse the JSON in a Groq response (tolerating text around it), reporting which key phrases it was for on failure"""
+    try:
+        return extract_json(definition_str)
+    except ValueError as e:
+        logger.error("JSON decoding failed for key phrase: %s", ', '.join(key_phrases))
+        logger.error("Response: %s...", definition_str[:500])
+        raise
 
-def generate_definition_for_item(item, model="llama-3.3-70b-versatile"):
+
+async def generate_definition_for_item(item, model="llama-3.3-70b-versatile", session=None, use_cache=True,
+                                       prompt_template=PROMPT_TEMPLATE, throttle=None):
     """
     Generate definition for a single item from selected.json using Groq.
     Returns a dictionary with the definition and metadata
@@ -75,125 +216,213 @@ def generate_definition_for_item(item, model="llama-3.3-70b-versatile"):
     Args:
         item: Item from selected.json
         model: Model to use ("llama-3.3-70b-versatile" for Llama-3-70b or "deepseek-r1-distill-llama-70b" for Deepseek)
+        session: Session from create_session, shared by the requests of a run (None to open one for this item)
+        use_cache: If False, bypass the on-disk response cache and always call the API
+        prompt_template: Prompt template the item is appended to (prompt.txt by default)
+        throttle: Held around each Groq request, not around cache hits (see call_groq)
     """
-    # Load prompt template
-    prompt_template = load_prompt_template()
-    
-    prompt_text = prompt_template + "\n\n"
+    prompt_text = build_prompt(item, template=prompt_template)
     
-    # Add key legal term
+    # Call Groq to get definition JSON string
     key_phrase = item.get("key_phrase", "")
-    prompt_text += f"Key legal term: {key_phrase}\n\n"
-    
-    # Add UK act URL (if exists)
-    legislation_urls = item.get("legislation_urls", [])
-    act_url = ""
-    if legislation_urls:
-        # Truncate URL at "/section"
-        act_url = legislation_urls[0].split("/section")[0]
-    prompt_text += f"URL of the UK act from which the term is taken: {act_url}\n\n"
-    
-    # Add paragraphs
-    paragraphs_urls = []
-    paragraphs_texts = []
-    for i, paragraph in enumerate(item.get("paragraphs", []), start=1):
-        text = paragraph.get("paragraph_text", "")
-        cleaned_text = re.sub(r'\s+', ' ', text).strip()
-        prompt_text += f"Paragraph #{i}: {cleaned_text}\n\n"
-        
-        # Collect paragraph URLs and texts
-        paragraphs_urls.append(paragraph.get("case_law_url", ""))
-        paragraphs_texts.append(text)
+    definition_str = await call_groq(session, prompt_text, model=model, key_phrase=key_phrase, use_cache=use_cache,
+                                     throttle=throttle)
+    definition_json = _parse_response(definition_str, [key_phrase])
     
-    # Call Groq to get definition JSON string
-    definition_str = call_groq(prompt_text, model=model)
+    return build_result(item, definition_json, model)
+
+
+async def generate_definitions_batch(items, model="llama-3.3-70b-versatile", session=None, use_cache=True,
+                                     prompt_template=PROMPT_TEMPLATE, throttle=None):
+    """
+    Generate definitions for several items from selected.json with a single Groq request.
+    The prompt template is sent once, followed by all the items, and the model returns one definition per item.
+    The definitions are matched to the items by their "item" number (the N of "Item #N"), so the model may
+    return them in any order and items sharing a key phrase are told apart. Raises ValueError if an item
+    gets no definition, more than one, or one for another key legal term.
+    Returns the result dictionaries in the same order as items.
     
-    # Parse JSON response
-    try:
-        definition_json = json.loads(definition_str)
-    except json.JSONDecodeError as e:
-        print(f"JSON decoding failed for key phrase: {key_phrase}")
-        print(f"Response: {definition_str[:500]}...")
-        raise
+    Args:
+        items: Items from selected.json
+        model, session, use_cache, prompt_template, throttle: As in generate_definition_for_item
+    """
+    prompt_text = build_batch_prompt(items, template=prompt_template, instruction=BATCH_INSTRUCTION)
     
-    # Build the result object
-    result = {
-        "key_phrase": definition_json.get("key legal term", key_phrase),
-        "definition": definition_json.get("definition", ""),
-        "reasoning": definition_json.get("reasoning", ""),
-        "confidence": definition_json.get("confidence", "Low"),
-        "model": model,
-        "act_url": act_url,
-        "paragraphs_urls": paragraphs_urls,
-    }
+    # Call Groq to get the definitions JSON string
+    key_phrases = [item.get("key_phrase", "") for item in items]
+    definitions_str = await call_groq(session, prompt_text, model=model, key_phrase=", ".join(key_phrases),
+                                      use_cache=use_cache, throttle=throttle)
+    definitions = _parse_response(definitions_str, key_phrases).get("definitions", [])
     
-    # Add paragraphs texts dynamically
-    for idx, para_text in enumerate(paragraphs_texts, start=1):
-        result[f"paragraphs_texts_{idx}"] = para_text
+    by_number = {}
+    for definition_json in definitions:
+        if not isinstance(definition_json, dict):
+            continue
+        try:
+            n = int(definition_json.get("item"))
+        except (TypeError, ValueError):
+            continue
+        if n in by_number:
+            raise ValueError(f"More than one definition returned for item #{n}")
+        by_number[n] = definition_json
     
-    return result
+    results = []
+    for n, (item, key_phrase) in enumerate(zip(items, key_phrases), start=1):
+        definition_json = by_number.get(n)
+        if definition_json is None:
+            raise ValueError(f"No definition returned for item #{n} ('{key_phrase}')")
+        # Check the model numbered the definition after the right item
+        key_legal_term = str(definition_json.get("key_legal_term", ""))
+        if key_legal_term.strip().casefold() != key_phrase.strip().casefold():
+            raise ValueError(f"Definition for '{key_legal_term}' returned as item #{n} ('{key_phrase}')")
+        results.append(build_result(item, definition_json, model))
+    return results
+
+
+def _journal_path(output_file):
+    """Path of the JSONL file where results are appended as they complete (output_file with a .jsonl extension)"""
+    return os.path.splitext(output_file)[0] + '.jsonl'
+
+
+def _load_journal(journal_file):
+    """Load the definitions journaled by an interrupted run (a line cut short by a crash is ignored)"""
+    journaled = []
+    if os.path.exists(journal_file):
+        with open(journal_file, 'rb') as f:
+            for line in f:
+                try:
+                    journaled.append(orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    continue
+    return journaled
 
 
-def main(input_file='selected.json', output_file='definitions_groq.json', model="llama-3.3-70b-versatile", limit=None):
+async def main(input_file='selected.json', output_file='definitions_groq.json', model="llama-3.3-70b-versatile", limit=None,
+               max_concurrency=MAX_CONCURRENCY, rpm=REQUESTS_PER_MINUTE, use_cache=True, batch_size=1, data=None):
     """
     Main function to process selected.json and generate definitions using Groq.
+    Items are processed concurrently over a single HTTP session. The requests actually sent to Groq
+    (cache hits are not) are bounded by max_concurrency and rate limited to rpm so they stay under the Groq rate limit.
+    Each definition is appended to a JSONL journal next to output_file as soon as it is generated,
+    so an interrupted run loses nothing: re-running skips the items already in output_file or in the journal
+    (same key phrase and paragraph URLs). The journal is merged into output_file (a JSON array) at the end of the run,
+    in the input order.
     
     Args:
         input_file: Path to input JSON file
         output_file: Path to output JSON file
         model: Model to use ("llama-3.3-70b-versatile" for Llama-3-70b or "deepseek-r1-distill-llama-70b" for Deepseek)
         limit: Number of items to process (None for all)
+        max_concurrency: Maximum number of requests in flight at once
+        rpm: Maximum number of requests per minute
+        use_cache: If False, bypass the on-disk response cache and always call the API
+        batch_size: Number of items sent in a single request (1 for one request per item; keep it small,
+                    at most 5, so the definitions fit in the response token limit).
+                    If a batch request fails, its items are retried one request per item.
+        data: Items to process, already loaded (input_file is not read if given)
     """
-    print(f"Loading data from {input_file}...")
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
+    if data is None:
+        logger.info("Loading data from %s...", input_file)
+        with open(input_file, 'rb') as f:
+            data = orjson.loads(f.read())
     
     # Limit to first N items if specified
     if limit:
         data = data[:limit]
-        print(f"Processing first {limit} items with model {model}...")
+        logger.info("Processing first %d items with model %s...", limit, model)
+    
+    # Position of each item in the input, so the output file keeps the input order
+    order = {item_resume_key(item): position for position, item in enumerate(data)}
+    
+    # Resume: keep definitions from a previous run (the output_file of a completed run and the journal
+    # of an interrupted one) and skip their items, identified by key phrase and paragraph URLs
+    journal_file = _journal_path(output_file)
+    results = load_json_list(output_file)
+    generated = _load_journal(journal_file)
+    if results or generated:
+        done = {record_resume_key(d) for d in results + generated}
+        data = [item for item in data if item_resume_key(item) not in done]
+        logger.info("Resuming: %d definitions already generated, %d items left", len(results) + len(generated), len(data))
     
-    results = []
     total = len(data)
     
-    for idx, item in enumerate(data, 1):
-        key_phrase = item.get("key_phrase", "")
-        print(f"\n[{idx}/{total}] Processing: {key_phrase}")
+    throttle = Throttle(max_concurrency, rpm)
+    
+    async with create_session(max_connections=max_concurrency) as session:
+        async def process_item(item):
+            try:
+                return [(item, await generate_definition_for_item(item, model=model, session=session,
+                                                                  use_cache=use_cache, throttle=throttle))]
+            except Exception as e:
+                return [(item, e)]
         
-        try:
-            result = generate_definition_for_item(item, model=model)
-            results.append(result)
-            print(f"✓ Generated definition with confidence: {result.get('confidence', 'Unknown')}")
-            
-            # Small delay to avoid rate limiting
-            time.sleep(1)
+        async def process_batch(batch):
+            """Process a batch of items, returning (item, result or exception) pairs"""
+            if len(batch) > 1:
+                try:
+                    batch_results = await generate_definitions_batch(batch, model=model, session=session,
+                                                                     use_cache=use_cache, throttle=throttle)
+                except Exception as e:
+                    logger.warning("⚠ Batch request failed (%s), falling back to one request per item", e)
+                else:
+                    return list(zip(batch, batch_results))
             
-        except Exception as e:
-            print(f"✗ Error processing {key_phrase}: {str(e)}")
-            # Continue with next item
-            continue
+            outcomes = await asyncio.gather(*(process_item(item) for item in batch))
+            return [pair for outcome in outcomes for pair in outcome]
+        
+        tasks = [process_batch(data[i:i + batch_size]) for i in range(0, total, batch_size)]
+        idx = 0
+        with open(journal_file, 'ab') as journal:
+            # Results are handled in completion order, so each one reaches the disk as soon as it is ready
+            for task in asyncio.as_completed(tasks):
+                for item, outcome in await task:
+                    idx += 1
+                    key_phrase = item.get("key_phrase", "")
+                    
+                    if isinstance(outcome, Exception):
+                        logger.error("✗ [%d/%d] Error processing %s: %s", idx, total, key_phrase, outcome)
+                        # Continue with next item
+                        continue
+                    
+                    generated.append(outcome)
+                    journal.write(orjson.dumps(outcome) + b"\n")
+                    journal.flush()
+                    if logger.isEnabledFor(logging.INFO):
+                        logger.info("✓ [%d/%d] Generated definition for %s with confidence: %s",
+                                    idx, total, key_phrase, outcome.get('confidence', 'Unknown'))
     
-    # Save results
-    print(f"\nSaving results to {output_file}...")
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    # Results are generated in completion order, put them back in the input order
+    generated.sort(key=lambda d: order.get(record_resume_key(d), len(order)))
+    results.extend(generated)
     
-    print(f"✓ Generated {len(results)} definitions using {model}")
+    # Save results as the JSON array read by the adjudication and combination steps
+    logger.info("\nSaving results to %s...", output_file)
+    atomic_write_json(output_file, results)
+    
+    # Everything in the journal is now in output_file
+    os.remove(journal_file)
+    
+    logger.info("✓ Generated %d definitions using %s", len(results), model)
     return results
 
 
 if __name__ == "__main__":
-    import sys
+    import argparse
+    from cli_types import positive_int, non_negative_int
     
-    # Default model
-    model = "llama-3.3-70b-versatile"
-    limit = None
+    parser = argparse.ArgumentParser(description="Generate definitions for the key phrases of selected.json with a Groq model.")
+    parser.add_argument("--model", default="llama-3.3-70b-versatile",
+                        help="Groq model (llama-3.3-70b-versatile or deepseek-r1-distill-llama-70b)")
+    parser.add_argument("--limit", type=non_negative_int, default=None, help="Number of items to process (default: all)")
+    parser.add_argument("--max-concurrency", type=positive_int, default=MAX_CONCURRENCY,
+                        help="Maximum number of requests in flight at once")
+    parser.add_argument("--rpm", type=positive_int, default=REQUESTS_PER_MINUTE, help="Maximum number of requests per minute")
+    parser.add_argument("--batch-size", type=positive_int, default=1, help="Number of items sent in a single request (at most 5)")
+    parser.add_argument("--no-cache", action="store_true", help="Bypass the on-disk response cache")
+    parser.add_argument("--input", default="selected.json", help="Input JSON file")
+    parser.add_argument("--output", default="definitions_groq.json", help="Output JSON file")
+    args = parser.parse_args()
     
-    # Parse command line arguments
-    if len(sys.argv) > 1:
-        model = sys.argv[1]  # First arg: model name
-    if len(sys.argv) > 2:
-        limit = int(sys.argv[2])  # Second arg: limit
-    
-    main(model=model, limit=limit)
-
+    asyncio.run(main(input_file=args.input, output_file=args.output, model=args.model, limit=args.limit,
+                     max_concurrency=args.max_concurrency, rpm=args.rpm, use_cache=not args.no_cache,
+                     batch_size=args.batch_size))
@@ -0,0 +1,99 @@
+"""
+Helpers for streaming JSON.
+The scanner reads a JSON object out of a streamed LLM response: it tracks brace depth as text arrives,
+so the caller can stop consuming the stream as soon as the top-level object is closed.
+iter_items reads the items of a JSON array file (e.g. selected.json) one at a time.
+load_json_list and atomic_write_json read and write the JSON array files written by the scripts.
+"""
+
+import os
+import ijson
+import orjson
+
+
+class JsonObjectScanner:
+    """
+    Incrementally scan streamed text for a complete top-level JSON object.
+    Braces inside JSON strings (including escaped quotes) are ignored, and so is any text before the object
+    (there is none when the response is constrained to a JSON schema).
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._length = 0
+        self._start = None
+        self._end = None
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    @property
+    def complete(self):
+        """True once the top-level object has been closed"""
+        return self._end is not None
+
+    def feed(self, chunk):
+        """Add a chunk of streamed text. Returns True once the top-level object is complete."""
+        offset = self._length
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+        if self.complete:
+            return True
+
+        for i, char in enumerate(chunk, offset):
+            if self._start is None:
+                if char != '{':
+                    continue
+                self._start = i
+                self._depth = 1
+            elif self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == '{':
+                self._depth += 1
+            elif char == '}':
+                self._depth -= 1
+                if self._depth == 0:
+                    self._end = i + 1
+                    return True
+        return False
+
+    @property
+    def text(self):
+        """The JSON object text if complete, otherwise everything received so far"""
+        received = "".join(self._chunks)
+        if self.complete:
+            return received[self._start:self._end]
+        return received.strip()
+
+
+def iter_items(path):
+    """
+    Yield the items of the top-level JSON array in path one at a time,
+    without loading the whole file in memory.
+    Numbers are returned as floats rather than Decimal, as json.load does.
+    """
+    with open(path, 'rb') as f:
+        yield from ijson.items(f, 'item', use_float=True)
+
+
+def load_json_list(path):
+    """Load the JSON array in path, e.g. the definitions written by a previous run (empty list if there is no file)"""
+    if not os.path.exists(path):
+        return []
+    with open(path, 'rb') as f:
+        return orjson.loads(f.read())
+
+
+def atomic_write_json(path, obj):
+    """Write JSON to a temporary file and move it into place, so the file is never left half-written"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    os.replace(tmp_path, path)
@@ -0,0 +1,74 @@
+"""
+Persistent on-disk cache of LLM responses.
+Responses are stored in a SQLite database keyed by the SHA256 of (model, prompt),
+so identical requests made on re-runs are answered from disk instead of calling the API again.
+"""
+
+import orjson
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Location of the cache database
+CACHE_FILE = 'llm_cache.db'
+
+_connection = None
+_lock = threading.Lock()
+
+
+def _get_connection():
+    """Open the cache database on first use and create the table if needed"""
+    global _connection
+    if _connection is None:
+        # The connection is shared by asyncio workers and worker threads
+        _connection = sqlite3.connect(CACHE_FILE, check_same_thread=False)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, response TEXT, created_at REAL)"
+        )
+        _connection.commit()
+    return _connection
+
+
+def make_key(model, prompt_text):
+    """Compute the cache key for a (model, prompt) pair"""
+    return hashlib.sha256(f"{model}\0{prompt_text}".encode('utf-8')).hexdigest()
+
+
+def get(model, prompt_text):
+    """Return the cached response for (model, prompt), or None on a miss"""
+    key = make_key(model, prompt_text)
+    with _lock:
+        row = _get_connection().execute("SELECT response FROM cache WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def put(model, prompt_text, response):
+    """Store the response for (model, prompt), replacing any previous entry"""
+    key = make_key(model, prompt_text)
+    with _lock:
+        connection = _get_connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO cache (key, response, created_at) VALUES (?, ?, ?)",
+            (key, response, time.time())
+        )
+        connection.commit()
+
+
+def is_json(response):
+    """Check whether a response parses as JSON"""
+    try:
+        orjson.loads(response)
+        return True
+    except orjson.JSONDecodeError:
+        return False
+
+
+def put_valid(model, prompt_text, response, is_valid=is_json):
+    """
+    Store the response for (model, prompt) only if is_valid(response),
+    so malformed responses are not cached and are retried on the next run
+    """
+    if is_valid(response):
+        put(model, prompt_text, response)
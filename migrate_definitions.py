@@ -0,0 +1,61 @@
+"""
+One-shot migration of definition files written by earlier versions of the scripts.
+Records used to carry the paragraph texts under per-index keys (paragraphs_texts_1, paragraphs_texts_2, ...).
+Records now only keep paragraphs_urls, the texts being looked up in selected.json, so this script
+removes the per-index keys from the given files, in place.
+"""
+
+import re
+import os
+import sys
+from json_stream import load_json_list, atomic_write_json
+
+# Files written by the pipeline that may contain per-index paragraph texts
+DEFAULT_FILES = [
+    'definitions_gpt4o_mini.json',
+    'definitions_llama.json',
+    'definitions_deepseek.json',
+    'definitions_adjudicated.json',
+    'tovalidate.json',
+]
+
+_LEGACY_KEY_RE = re.compile(r'paragraphs_texts_\d+$')
+
+
+def migrate_record(record):
+    """Return the record without its per-index paragraph text keys"""
+    return {key: value for key, value in record.items() if not _LEGACY_KEY_RE.match(key)}
+
+
+def migrate_file(path):
+    """
+    Remove the per-index paragraph text keys from all the records of a definition file.
+    Returns the number of records that were changed.
+    """
+    records = load_json_list(path)
+
+    migrated = [migrate_record(record) for record in records]
+    changed = sum(1 for record, new in zip(records, migrated) if len(new) != len(record))
+
+    if changed:
+        atomic_write_json(path, migrated)
+    return changed
+
+
+def main(files=None):
+    """
+    Migrate the given definition files (the pipeline's output files by default).
+
+    Args:
+        files: Paths of the JSON files to migrate (None for DEFAULT_FILES)
+    """
+    for path in files or DEFAULT_FILES:
+        if not os.path.exists(path):
+            print(f"  ⚠ File not found: {path}")
+            continue
+        changed = migrate_file(path)
+        print(f"  ✓ {path}: {changed} records migrated")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,61 @@
+"""
+Script to preprocess selected.json once before generating definitions.
+The whitespace of every paragraph text is normalised and stored in a paragraph_text_cleaned field,
+written to selected.cleaned.json, so the generation scripts (run for each model) do not clean
+the same paragraphs again for every model and every run.
+"""
+
+import re
+import os
+import orjson
+from json_stream import atomic_write_json
+
+_WS_RE = re.compile(r'\s+')
+
+
+def clean_text(text):
+    """Collapse runs of whitespace (including newlines) into single spaces"""
+    return _WS_RE.sub(' ', text).strip()
+
+
+def cleaned_paragraph_text(paragraph):
+    """
+    Text of a paragraph as sent to the models: the precomputed paragraph_text_cleaned field
+    when the item comes from selected.cleaned.json, otherwise paragraph_text cleaned on the fly
+    """
+    cleaned_text = paragraph.get("paragraph_text_cleaned")
+    if cleaned_text is None:
+        cleaned_text = clean_text(paragraph.get("paragraph_text", ""))
+    return cleaned_text
+
+
+def main(input_file='selected.json', output_file='selected.cleaned.json'):
+    """
+    Add the cleaned text of every paragraph of input_file and save the result to output_file.
+    Nothing is done if output_file is already newer than input_file.
+
+    Args:
+        input_file: Path to input JSON file
+        output_file: Path to output JSON file
+    """
+    if os.path.exists(output_file) and os.path.getmtime(output_file) >= os.path.getmtime(input_file):
+        print(f"✓ {output_file} is up to date")
+        return output_file
+
+    print(f"Loading data from {input_file}...")
+    with open(input_file, 'rb') as f:
+        data = orjson.loads(f.read())
+
+    for item in data:
+        for paragraph in item.get("paragraphs", []):
+            paragraph["paragraph_text_cleaned"] = clean_text(paragraph.get("paragraph_text", ""))
+
+    # Written atomically so a half-written file is never taken as up to date
+    atomic_write_json(output_file, data)
+
+    print(f"✓ Preprocessed {len(data)} items into {output_file}")
+    return output_file
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""
+Groq models and per-provider request limits used when the first-step providers are run together
+(run_all_providers.py and the provider cascade in cascade.py).
+"""
+
+LLAMA_MODEL = "llama-3.3-70b-versatile"
+DEEPSEEK_MODEL = "deepseek-r1-distill-llama-70b"
+
+# Requests per minute allowed by each provider (each API has its own limit)
+PROVIDER_RPM = {
+    "gpt4o_mini": 500,
+    "llama": 30,
+    "deepseek": 30,
+}
+
+# Maximum number of requests in flight at once per provider
+MAX_CONCURRENCY = 10
@@ -0,0 +1,76 @@
+"""
+Script to run the three first-step providers concurrently and adjudicate the results.
+GPT-4o-mini (OpenAI), Llama-3.3-70b and Deepseek-r1-70b (Groq) generate definitions in parallel,
+so the first step takes as long as the slowest provider instead of the sum of all three.
+Each provider resumes its output file as the scripts run on their own do, and the definitions
+are then passed in memory to the adjudication step (Claude Sonnet 4).
+"""
+
+import orjson
+import asyncio
+import generate_definitions_with_gpt4o as gpt4o
+import generate_definitions_with_groq as groq
+from adjudicate_definitions import main as adjudicate
+from providers import LLAMA_MODEL, DEEPSEEK_MODEL, PROVIDER_RPM, MAX_CONCURRENCY
+
+
+async def generate_all(data, gpt4o_output_file, llama_output_file, deepseek_output_file):
+    """
+    Run the three providers concurrently over the same items.
+    Each provider goes through the main function of its script, so its output file is resumed
+    and written the same way as when the script is run on its own (the items already in it are skipped).
+    Returns the (gpt4o_defs, llama_defs, deepseek_defs) lists, the full contents of the output files.
+    """
+    return await asyncio.gather(
+        gpt4o.main(output_file=gpt4o_output_file, data=data,
+                   max_concurrency=MAX_CONCURRENCY, rpm=PROVIDER_RPM["gpt4o_mini"]),
+        groq.main(output_file=llama_output_file, model=LLAMA_MODEL, data=data,
+                  max_concurrency=MAX_CONCURRENCY, rpm=PROVIDER_RPM["llama"]),
+        groq.main(output_file=deepseek_output_file, model=DEEPSEEK_MODEL, data=data,
+                  max_concurrency=MAX_CONCURRENCY, rpm=PROVIDER_RPM["deepseek"]),
+    )
+
+
+def main(input_file='selected.json',
+         gpt4o_output_file='definitions_gpt4o_mini.json',
+         llama_output_file='definitions_llama.json',
+         deepseek_output_file='definitions_deepseek.json',
+         adjudicated_output_file='definitions_adjudicated.json',
+         limit=None):
+    """
+    Main function to generate definitions with all providers and adjudicate them.
+
+    Args:
+        input_file: Path to input JSON file
+        gpt4o_output_file: Output file for GPT-4o-mini definitions
+        llama_output_file: Output file for Llama definitions
+        deepseek_output_file: Output file for Deepseek definitions
+        adjudicated_output_file: Output file for adjudicated definitions
+        limit: Number of items to process (None for all)
+    """
+    print(f"Loading data from {input_file}...")
+    with open(input_file, 'rb') as f:
+        data = orjson.loads(f.read())
+
+    # Limit to first N items if specified
+    if limit:
+        data = data[:limit]
+        print(f"Processing first {limit} items...")
+
+    print("\nGenerating definitions with all providers concurrently...")
+    gpt4o_defs, llama_defs, deepseek_defs = asyncio.run(
+        generate_all(data, gpt4o_output_file, llama_output_file, deepseek_output_file))
+
+    # Adjudicate in-process, without re-reading the files just written
+    print("\nAdjudicating definitions with Claude Sonnet 4...")
+    return adjudicate(gpt4o_defs=gpt4o_defs,
+                      llama_defs=llama_defs,
+                      deepseek_defs=deepseek_defs,
+                      original_data=data,
+                      output_file=adjudicated_output_file)
+
+
+if __name__ == "__main__":
+    import sys
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    main(limit=limit)
@@ -5,64 +5,108 @@ Claude Sonnet 4 is used only for adjudication and regeneration.
 """
 
 import os
-import json
 import sys
+import orjson
+import asyncio
 from generate_definitions_with_gpt4o import main as generate_gpt4o_mini
 from generate_definitions_with_groq import main as generate_groq
-from adjudicate_definitions import main as adjudicate
+from adjudicate_definitions import main as adjudicate, FALLBACK_METHOD
 from combine_results import combine_results
+from preprocess_selected import main as preprocess_selected
+from json_stream import load_json_list
+from definition_prompt import item_resume_key, record_resume_key
 
 
-def main(limit=2):
+def _key_phrase(entry):
+    """Key of an item or record for the adjudication step, which resumes by key phrase"""
+    return entry.get("key_phrase", "")
+
+
+def _missing_items(items, output_file, item_key=item_resume_key, record_key=record_resume_key):
+    """
+    Items not yet in a step's output file (all of them if the file does not exist), matched with the key
+    the step resumes with: key phrase and paragraph URLs for the generation steps (the default),
+    so duplicates of a key phrase are not taken as done, and key phrase for the adjudication.
+    Fallback adjudications count as missing, so they are adjudicated again.
+    """
+    done = {record_key(d) for d in load_json_list(output_file)
+            if d.get("adjudication_method") != FALLBACK_METHOD}
+    return [item for item in items if item_key(item) not in done]
+
+
+async def generate_first_step(items):
+    """
+    Run steps 1-3 concurrently.
+    The three models are independent (different providers or models, each with its own rate limit),
+    so the first step takes as long as the slowest of them instead of the sum of all three.
+    Each model is only given the items missing from its output file, and skipped if there are none.
+    """
+    steps = [
+        ("GPT-4o-mini", 'definitions_gpt4o_mini.json',
+         lambda data: generate_gpt4o_mini(output_file='definitions_gpt4o_mini.json', data=data)),
+        ("Llama-3.3-70b-versatile", 'definitions_llama.json',
+         lambda data: generate_groq(output_file='definitions_llama.json',
+                                    model="llama-3.3-70b-versatile", data=data)),
+        ("deepseek-r1-distill-llama-70b", 'definitions_deepseek.json',
+         lambda data: generate_groq(output_file='definitions_deepseek.json',
+                                    model="deepseek-r1-distill-llama-70b", data=data)),
+    ]
+    
+    tasks = []
+    for name, output_file, generate in steps:
+        missing = _missing_items(items, output_file)
+        if not missing:
+            print(f"✓ {name}: {output_file} already covers all {len(items)} key phrase(s), skipped")
+            continue
+        print(f"  {name}: {len(missing)} of {len(items)} key phrase(s) to generate")
+        tasks.append(generate(missing))
+    
+    await asyncio.gather(*tasks)
+
+
+def main(limit=2, input_file='selected.json'):
     """
     Main function to run the complete system.
     
     Args:
-        limit: Number of key phrases to process (default: 2)
+        limit: Number of key phrases to process (default: 2, 0 or None for all)
+        input_file: Input JSON file with the key phrases and case law paragraphs
     """
     print("\n" + "="*80)
     print("MULTI-MODEL DEFINITION GENERATION SYSTEM")
     print("="*80)
-    print(f"Processing {limit} key phrase(s)...\n")
+    print(f"Processing {limit} key phrase(s)...\n" if limit else "Processing all key phrases...\n")
     
     try:
-        # Step 1: Generate with GPT-4o-mini
-        print("\n" + "="*80)
-        print("STEP 1: Generating definitions with GPT-4o-mini")
-        print("="*80)
-        generate_gpt4o_mini(input_file='selected.json', 
-                           output_file='definitions_gpt4o_mini.json', 
-                           limit=limit)
-        
-        # Step 2: Generate with Groq (Llama-3-70b)
-        print("\n" + "="*80)
-        print("STEP 2: Generating definitions with Groq (Llama-3.3-70b-versatile)")
-        print("="*80)
-        generate_groq(input_file='selected.json',
-                     output_file='definitions_llama.json',
-                     model="llama-3.3-70b-versatile",
-                     limit=limit)
+        # Clean the paragraph texts once for all the models
+        cleaned_file = os.path.splitext(input_file)[0] + '.cleaned.json'
+        input_file = preprocess_selected(input_file=input_file, output_file=cleaned_file)
+        with open(input_file, 'rb') as f:
+            items = orjson.loads(f.read())
+        if limit:
+            items = items[:limit]
         
-        # Step 3: Generate with Groq (Deepseek-r1-70b)
+        # Steps 1-3: Generate with GPT-4o-mini, Groq (Llama-3-70b) and Groq (Deepseek-r1-70b)
         print("\n" + "="*80)
-        print("STEP 3: Generating definitions with Groq (deepseek-r1-distill-llama-70b)")
+        print("STEPS 1-3: Generating definitions with GPT-4o-mini, Groq (Llama-3.3-70b-versatile)")
+        print("           and Groq (deepseek-r1-distill-llama-70b) concurrently")
         print("="*80)
-        generate_groq(input_file='selected.json',
-                     output_file='definitions_deepseek.json',
-                     model="deepseek-r1-distill-llama-70b",
-                     limit=limit)
+        asyncio.run(generate_first_step(items))
         
         # Step 4: Adjudicate definitions (Claude Sonnet 4 used here)
         print("\n" + "="*80)
         print("STEP 4: Adjudicating definitions with Claude Sonnet 4")
         print("="*80)
-        adjudicate(claude_definitions_file=None,  # Claude not used in first step
-                  gpt4o_definitions_file='definitions_gpt4o_mini.json',
-                  llama_definitions_file='definitions_llama.json',
-                  deepseek_definitions_file='definitions_deepseek.json',
-                  original_data_file='selected.json',
-                  output_file='definitions_adjudicated.json',
-                  limit=limit)
+        missing = _missing_items(items, 'definitions_adjudicated.json', item_key=_key_phrase, record_key=_key_phrase)
+        if missing:
+            adjudicate(claude_definitions_file=None,  # Claude not used in first step
+                      gpt4o_definitions_file='definitions_gpt4o_mini.json',
+                      llama_definitions_file='definitions_llama.json',
+                      deepseek_definitions_file='definitions_deepseek.json',
+                      output_file='definitions_adjudicated.json',
+                      original_data=missing)
+        else:
+            print(f"✓ definitions_adjudicated.json already covers all {len(items)} key phrase(s), skipped")
         
         # Step 5: Combine results
         print("\n" + "="*80)
@@ -93,6 +137,12 @@ def main(limit=2):
 
 
 if __name__ == "__main__":
-    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 2
-    main(limit=limit)
-
+    import argparse
+    from cli_types import non_negative_int
+    
+    parser = argparse.ArgumentParser(description="Run the complete multi-model definition generation system.")
+    parser.add_argument("--limit", type=non_negative_int, default=2, help="Number of key phrases to process (default: 2, 0 for all)")
+    parser.add_argument("--input", default="selected.json", help="Input JSON file")
+    args = parser.parse_args()
+    
+    main(limit=args.limit, input_file=args.input)
@@ -0,0 +1,32 @@
+"""
+Throttling of the requests sent to an API.
+A Throttle bounds the number of requests in flight and the number of requests per minute.
+It is held around each HTTP request only (after the on-disk cache lookup), so cached responses
+never wait for it nor use up the rate limit.
+"""
+
+import asyncio
+from aiolimiter import AsyncLimiter
+
+
+class Throttle:
+    """
+    Async context manager combining a concurrency limit and a rate limit:
+    entering it takes a slot among max_concurrency and a token among rpm per minute.
+    """
+
+    def __init__(self, max_concurrency, rpm):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.limiter = AsyncLimiter(rpm, 60)
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        try:
+            await self.limiter.acquire()
+        except BaseException:
+            self.semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.semaphore.release()